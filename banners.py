@@ -0,0 +1,192 @@
+"""
+期間限定ガチャ（バナー）
+
+バナーは data/banners.json にデータとして定義する:
+
+    {"banners": [
+        {"id": "base", "name": "バレンタインガチャ"},
+        {"id": "momo-pickup", "name": "モモ ピックアップ", "priority": 10,
+         "start": "2026-02-10T00:00", "end": "2026-02-15T00:00",
+         "pool": {"chname": ["モモ", "ナナ"]},
+         "rate_up": [{"chname": ["モモ"], "rarity": ["SSR", "UR"], "multiplier": 3.0}]}
+    ]}
+
+- start / end: JST（省略時は無期限）。end の時刻ちょうどに終了する
+- pool: 排出対象の絞り込み（no / chname / rarity。キー同士はAND、リスト内はOR。省略時は全カード）
+- rate_up: 条件に合うカードの排出率を multiplier 倍にする（複数該当なら掛け合わせる）
+- priority: 同時に開催中のバナーのうち、/gacha で指定がない時に使う順（大きいほど優先）
+
+抽選テーブルはカタログ読み込み時に全バナー分を作っておき、
+開始・終了時刻にはスケジューラーが開催中のバナーの表を丸ごと差し替えるだけにする。
+"""
+import json
+import logging
+from datetime import datetime
+from types import MappingProxyType
+
+from sampler import AliasSampler
+
+logger = logging.getLogger(__name__)
+
+BANNERS_PATH = "data/banners.json"
+DEFAULT_NAME = "ガチャ"
+MATCH_KEYS = ("no", "chname", "rarity")
+
+
+def _parse_time(value, tz):
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value)
+    return tz.localize(dt) if dt.tzinfo is None else dt
+
+
+def _filters(data):
+    return {key: frozenset(str(v) for v in data[key]) for key in MATCH_KEYS if key in data}
+
+
+def _matches(item, filters):
+    return all(item[key] in values for key, values in filters.items())
+
+
+class BannerSpec:
+    """banners.json の1件分"""
+    def __init__(self, id, name, start=None, end=None, pool=None, rate_up=(), priority=0):
+        self.id = id
+        self.name = name
+        self.start = start
+        self.end = end
+        self.pool = pool or {}
+        self.rate_up = tuple(rate_up)  # ((filters, multiplier), ...)
+        self.priority = priority
+
+    @classmethod
+    def from_dict(cls, data, tz):
+        return cls(
+            id=str(data["id"]),
+            name=data.get("name", DEFAULT_NAME),
+            start=_parse_time(data.get("start"), tz),
+            end=_parse_time(data.get("end"), tz),
+            pool=_filters(data.get("pool", {})),
+            rate_up=[(_filters(r), float(r["multiplier"])) for r in data.get("rate_up", [])],
+            priority=int(data.get("priority", 0)),
+        )
+
+    def is_open(self, now):
+        return (self.start is None or self.start <= now) and (self.end is None or now < self.end)
+
+    def weight(self, item):
+        weight = item["rate"]
+        for filters, multiplier in self.rate_up:
+            if _matches(item, filters):
+                weight *= multiplier
+        return weight
+
+
+class Banner:
+    """抽選テーブル作成済みのバナー（Catalogと同じく draw / draw_many で引ける）"""
+    __slots__ = ("spec", "items", "sampler", "catalog_version")
+
+    def __init__(self, spec, items, sampler, catalog_version):
+        self.spec = spec
+        self.items = items
+        self.sampler = sampler
+        self.catalog_version = catalog_version
+
+    @property
+    def id(self):
+        return self.spec.id
+
+    @property
+    def name(self):
+        return self.spec.name
+
+    def __len__(self):
+        return len(self.items)
+
+    def draw(self, rng=None):
+        return self.items[self.sampler.draw(rng)]
+
+    def draw_many(self, k, rng=None):
+        return [self.items[i] for i in self.sampler.draw_many(k, rng)]
+
+    @classmethod
+    def compile(cls, spec, catalog):
+        if not spec.pool and not spec.rate_up:
+            # 全カード・通常の排出率ならカタログのテーブルをそのまま使う
+            return cls(spec, catalog.items, catalog.sampler, catalog.version)
+        items = tuple(item for item in catalog.items if _matches(item, spec.pool))
+        sampler = AliasSampler([spec.weight(item) for item in items]).warm()
+        return cls(spec, items, sampler, catalog.version)
+
+
+class BannerBoard:
+    """
+    バナーの一覧と開催中のバナー
+    開催中の表(active)は読み取り専用のdictで、更新時は新しい表に丸ごと差し替える。
+    """
+    def __init__(self, tz, path=BANNERS_PATH):
+        self.tz = tz
+        self.path = path
+        self.specs = []
+        self._compiled = {}  # banner_id -> Banner（開催前・終了後のものも含む）
+        self.active = MappingProxyType({})
+        self.default = None  # 開催中で最も優先度の高いバナー
+
+    def load(self):
+        """banners.json を読み込む（ファイルがなければ全カードの通常ガチャ1つ）"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            specs = [BannerSpec.from_dict(b, self.tz) for b in data.get("banners", [])]
+        except FileNotFoundError:
+            logger.warning(f"{self.path} がないため通常ガチャのみで開始します")
+            specs = []
+        if not specs:
+            specs = [BannerSpec("base", DEFAULT_NAME)]
+        self.specs = specs
+        logger.info(f"Loaded {len(specs)} banner(s)")
+        return specs
+
+    def compile(self, catalog):
+        """全バナーの抽選テーブルを作る（カタログ読み込み・更新時。別スレッドで呼んでよい）"""
+        compiled = {}
+        if not catalog:
+            self._compiled = compiled
+            return compiled
+        for spec in self.specs:
+            try:
+                compiled[spec.id] = Banner.compile(spec, catalog)
+            except ValueError as e:
+                logger.error(f"バナー {spec.id} の抽選テーブルを作れません: {e}")
+        self._compiled = compiled
+        return compiled
+
+    def refresh(self, now=None):
+        """現在開催中のバナーの表を作り直して差し替える。変わったらTrue"""
+        now = now or datetime.now(self.tz)
+        open_specs = sorted((s for s in self.specs if s.is_open(now) and s.id in self._compiled),
+                            key=lambda s: (s.priority, s.start or now), reverse=True)
+        active = {s.id: self._compiled[s.id] for s in open_specs}
+        changed = (active.keys() != self.active.keys()
+                   or any(active[k] is not self.active[k] for k in active))
+        self.active = MappingProxyType(active)
+        self.default = active[open_specs[0].id] if open_specs else None
+        if changed:
+            logger.info(f"Active banners: {', '.join(active) or '-'}")
+        return changed
+
+    def banner(self, banner_id):
+        """開催期間に関係なく、作成済みのバナー（シミュレーション用）"""
+        return self._compiled.get(banner_id)
+
+    def get(self, banner_id=None):
+        """開催中のバナー（IDを省略したら優先度の最も高いもの）。なければNone"""
+        if banner_id is None:
+            return self.default
+        return self.active.get(banner_id)
+
+    def boundaries(self, now=None):
+        """これから来る開始・終了時刻（スケジューラーへの登録用）"""
+        now = now or datetime.now(self.tz)
+        times = {t for s in self.specs for t in (s.start, s.end) if t is not None and t > now}
+        return sorted(times)
@@ -0,0 +1,121 @@
+"""
+ベンチマーク用のダミーのDiscordオブジェクト
+ネットワークには接続せず、API呼び出しは回数を数えて指定時間だけ待つ。
+"""
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import discord
+
+
+class ApiCounter:
+    """ダミーAPIの呼び出し回数と疑似レイテンシ"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            await asyncio.sleep(0)
+
+
+_message_ids = itertools.count(1)
+
+
+class FakeMessage:
+    def __init__(self, api, content=None, embed=None, view=None):
+        self.api = api
+        self.id = next(_message_ids)
+        self.content = content
+        self.embed = embed
+        self.view = view
+
+    async def edit(self, **kwargs):
+        await self.api.call()
+        self.content = kwargs.get("content", self.content)
+        self.embed = kwargs.get("embed", self.embed)
+        self.view = kwargs.get("view", self.view)
+        return self
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        await self.interaction.api.call()
+        self._done = True
+
+    async def send_message(self, content=None, **kwargs):
+        await self.interaction.api.call()
+        self._done = True
+        self.interaction.original = FakeMessage(self.interaction.api, content, kwargs.get("embed"), kwargs.get("view"))
+
+    async def edit_message(self, **kwargs):
+        await self.interaction.api.call()
+        self._done = True
+        if self.interaction.message is not None:
+            self.interaction.message.embed = kwargs.get("embed", self.interaction.message.embed)
+            self.interaction.message.view = kwargs.get("view", self.interaction.message.view)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self.interaction.api.call()
+        return FakeMessage(self.interaction.api, content, kwargs.get("embed"), kwargs.get("view"))
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+
+
+def make_thread(thread_id, name, parent_id=0, owner_id=None):
+    """isinstance(x, discord.Thread) を満たすスレッド（本物の初期化はしない）"""
+    thread = discord.Thread.__new__(discord.Thread)
+    thread.id = thread_id
+    thread.name = name
+    thread.parent_id = parent_id
+    thread.owner_id = owner_id
+    return thread
+
+
+class FakeInteraction:
+    _next_id = 0
+
+    def __init__(self, client, user, channel, guild_id, api, message=None):
+        FakeInteraction._next_id += 1
+        self.id = FakeInteraction._next_id
+        self.token = f"token-{self.id}"
+        self.client = client
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.guild_id = guild_id
+        self.api = api
+        self.message = message
+        self.original = None
+        self.created_at = discord.utils.utcnow()
+        self.data = {}
+        self.namespace = SimpleNamespace()
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **kwargs):
+        await self.api.call()
+        if self.original is not None:
+            self.original.content = kwargs.get("content", self.original.content)
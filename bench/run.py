@@ -0,0 +1,401 @@
+"""
+オフライン負荷テスト・ベンチマーク
+
+Discordには接続せず、ダミーのInteractionで GachaCog / GachaButtonView / 一覧のページ送りボタンを
+実際のカタログ(data/gacha_data.csv)と一時ディレクトリのSQLiteに対して実行する。
+
+    python -m bench.run                     # 計測して bench/baseline.json と比較
+    python -m bench.run --users 5000 --concurrency 1000 --api-latency 0
+    python -m bench.run --update-baseline   # 今回の結果を基準値として保存
+
+スループット・操作ごとのp50/p99・ピークメモリ・イベントループ遅延を表示する。
+1回ごとに新しいプロセスで --runs 回計測し、各項目は中央値を使う。
+基準値との比較は、ばらつきの小さい項目（1操作あたりのAPI呼び出し回数・CPU時間、
+操作ごとのp50、ピークメモリ）だけで行い、許容幅(--tolerance)以上悪化していれば終了コード1で終わる。
+p99やループ遅延はイベントループが詰まっている時の待ち行列の長さで大きく揺れるので表示のみ。
+既定のシナリオは、APIレイテンシ(50ms)を入れてループが飽和しない程度の負荷にしてある。
+基準値は「ユーザー数・同時実行数・APIレイテンシ」の組み合わせごとに保存する。
+基準値のない組み合わせも終了コード1（--allow-missing-baseline で0）。
+Botの組み立ては main.py の bot と start_state() をそのまま使う。
+抽選の乱数（カタログ・バナーの抽選テーブル）は --seed で固定する。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import shutil
+import argparse
+import resource
+import tempfile
+import statistics
+import tracemalloc
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+LAG_PROBE_INTERVAL = 0.005  # イベントループ遅延の計測間隔(秒)
+
+# 基準値との比較で無視する小さな差（タイマーの誤差）
+LATENCY_SLACK = 0.001
+CPU_SLACK_MS = 0.05
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def load_app(frame_delay):
+    """
+    main.py をそのまま読み込んで使う（import しただけではDiscordに接続しない）
+    演出のフレーム間の待ち時間だけを差し替える
+    """
+    import main
+    main.bot.renderer = make_renderer(frame_delay)
+    return main
+
+
+def make_renderer(frame_delay):
+    """演出のフレーム間の待ち時間だけを frame_delay 倍にしたRevealScheduler（0なら待たない）"""
+    from render import RevealScheduler
+
+    class BenchRenderer(RevealScheduler):
+        async def reveal(self, interaction, frames):
+            frames = [(delay * frame_delay, kwargs) for delay, kwargs in frames]
+            await super().reveal(interaction, frames)
+
+    return BenchRenderer()
+
+
+def seed_samplers(bot, seed):
+    """カタログと全バナーの抽選テーブルの乱数を固定する"""
+    samplers = [bot.catalog.current.sampler]
+    samplers += [banner.sampler for banner in map(bot.banners.banner, (s.id for s in bot.banners.specs)) if banner]
+    for sampler in {id(s): s for s in samplers}.values():
+        sampler.seed(seed)
+
+
+class Recorder:
+    """操作ごとの所要時間"""
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def measure(self, name, coro):
+        started = time.perf_counter()
+        try:
+            result = await coro
+        except Exception as e:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            logging.getLogger(__name__).exception(f"{name} failed: {e}")
+            return None
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        return result
+
+
+async def probe_loop_lag(samples, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + LAG_PROBE_INTERVAL
+        await asyncio.sleep(LAG_PROBE_INTERVAL)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+def _page_button(view, slot):
+    for child in view.children:
+        if child.custom_id.split(":")[2] == slot:
+            return child
+    raise LookupError(slot)
+
+
+async def user_session(bot, cog, user_id, api, recorder):
+    """1ユーザー分の操作: /gacha → 単発 → 10連 → /artlistnum → ページ送り → /artlistch → ページ送り → /artsearch → /progress → /ranking"""
+    from bench.fakes import FakeUser, FakeInteraction, FakeMessage, make_thread
+
+    user = FakeUser(user_id)
+    thread = make_thread(user_id + 1, f"gacha-thread-{user.name}")
+    # サーバー全体の上限で弾かれないよう、ユーザーごとに別サーバー扱いにする
+    guild_id = user_id + 2
+    bot.register_thread(guild_id, user_id, thread.id)
+
+    def interaction(message=None):
+        return FakeInteraction(bot, user, thread, guild_id, api, message)
+
+    cmd = interaction()
+    await recorder.measure("gacha_cmd", cog.gacha_cmd.callback(cog, cmd))
+    view = cmd.original.view
+
+    await recorder.measure("gacha_button", view.gacha_button_callback.callback(interaction()))
+    await recorder.measure("multi_gacha_button", view.multi_gacha_button_callback.callback(interaction()))
+
+    for command, name, clicks in ((cog.artlist_num, "artlist_num", 2), (cog.artlist_ch, "artlist_ch", 1)):
+        listing = interaction()
+        await recorder.measure(name, command.callback(cog, listing))
+        message = listing.original
+        for _ in range(clicks):
+            click = interaction(FakeMessage(api, embed=message.embed, view=message.view))
+            await recorder.measure("page_button", _page_button(click.message.view, "next").callback(click))
+            message = click.message
+
+    await recorder.measure("artsearch_autocomplete", cog.artsearch_autocomplete(interaction(), "もも"))
+    await recorder.measure("artsearch", cog.artsearch.callback(cog, interaction(), "冬"))
+    await recorder.measure("progress", cog.progress.callback(cog, interaction()))
+    await recorder.measure("ranking", cog.ranking.callback(cog, interaction()))
+
+
+async def run_scenario(args):
+    import db
+    from cogs.gacha import GachaCog
+    from bench.fakes import ApiCounter
+    from loopwatch import LoopWatchdog
+
+    app = load_app(args.frame_delay)
+    bot = app.bot
+    await app.start_state()
+    seed_samplers(bot, args.seed)
+    cog = GachaCog(bot)
+    api = ApiCounter(args.api_latency)
+    recorder = Recorder()
+
+    lag_samples = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(probe_loop_lag(lag_samples, stop))
+    watchdog = None
+    if args.watchdog_ms:
+        watchdog = LoopWatchdog(asyncio.get_running_loop(), args.watchdog_ms)
+        watchdog.start()
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    user_ids = [10**17 + i * 10 for i in range(args.users)]
+    random.shuffle(user_ids)
+
+    async def limited(user_id):
+        async with semaphore:
+            await user_session(bot, cog, user_id, api, recorder)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    await asyncio.gather(*(limited(uid) for uid in user_ids))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else 0
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    stop.set()
+    await lag_task
+    if watchdog is not None:
+        watchdog.stop()
+    await bot.close()
+
+    # 全員「初期15pt - 単発1pt - 10連10pt」になっているか（メモリとDBの両方）
+    expected = db.INITIAL_POINTS - 1 - 10
+    saved, _, _ = await db.run(db.load_state)
+    mismatched = sum(1 for uid in user_ids
+                     if bot.points.get(uid) != expected or saved.get(uid, (None,))[0] != expected)
+
+    ops = sum(len(v) for v in recorder.latencies.values())
+    return {
+        "users": args.users,
+        "elapsed_s": elapsed,
+        "throughput_ops": ops / elapsed if elapsed else 0.0,
+        "api_calls": api.calls,
+        "api_calls_per_op": api.calls / ops if ops else 0.0,
+        "cpu_ms_per_op": cpu * 1000 / ops if ops else 0.0,
+        "latency": {
+            name: {"p50": percentile(values, 0.5), "p99": percentile(values, 0.99), "count": len(values)}
+            for name, values in sorted(recorder.latencies.items())
+        },
+        "errors": recorder.errors,
+        "mismatched_users": mismatched,
+        "peak_traced_mb": traced_peak / 1024 / 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "loop_lag_p99": percentile(lag_samples, 0.99),
+        "loop_lag_max": max(lag_samples, default=0.0),
+        "render": dict(bot.renderer.stats),
+        "write_behind": bot.writer.stats.as_dict(),
+        "pull_lock": bot.pulls.locks.stats.as_dict(),
+        "watchdog": watchdog.stats.as_dict() if watchdog is not None else None,
+    }
+
+
+def run_once(args):
+    """
+    1回分の計測（main.py の bot はモジュールに1つなので、毎回新しいプロセスで呼ぶ）
+    DB・ジャーナル・ログは一時ディレクトリに作る（モジュールの読み込み前に設定する）
+    """
+    workdir = tempfile.mkdtemp(prefix="gacha-bench-")
+    os.environ["DB_PATH"] = os.path.join(workdir, "db.sqlite")
+    os.environ["LOG_PATH"] = os.path.join(workdir, "bot.log")
+    os.environ["EVENT_LOG_PATH"] = os.path.join(workdir, "events.jsonl")
+    os.environ["METRICS_PORT"] = "0"
+    # main.py と同じく data/ などのパスはリポジトリ直下からの相対パス
+    os.chdir(ROOT)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    random.seed(args.seed)
+
+    import botlog
+    botlog.setup_logging(logging.WARNING)
+
+    import db
+    try:
+        return asyncio.run(run_scenario(args))
+    finally:
+        db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# 複数回の計測で中央値をとる項目
+MEDIAN_KEYS = ("elapsed_s", "throughput_ops", "api_calls", "api_calls_per_op", "cpu_ms_per_op",
+               "peak_traced_mb", "peak_rss_mb", "loop_lag_p99", "loop_lag_max")
+
+
+def summarize(runs):
+    """複数回の結果を中央値でまとめる（内訳の統計はCPU時間が中央値の回のもの）"""
+    runs = sorted(runs, key=lambda r: r["cpu_ms_per_op"])
+    result = dict(runs[len(runs) // 2])
+    for key in MEDIAN_KEYS:
+        result[key] = statistics.median(r[key] for r in runs)
+    result["latency"] = {
+        name: {
+            "p50": statistics.median(r["latency"][name]["p50"] for r in runs if name in r["latency"]),
+            "p99": statistics.median(r["latency"][name]["p99"] for r in runs if name in r["latency"]),
+            "count": stat["count"],
+        }
+        for name, stat in result["latency"].items()
+    }
+    errors = {}
+    for r in runs:
+        for name, count in r["errors"].items():
+            errors[name] = errors.get(name, 0) + count
+    result["errors"] = errors
+    result["mismatched_users"] = sum(r["mismatched_users"] for r in runs)
+    result["runs"] = len(runs)
+    return result
+
+
+def print_report(result):
+    print(f"users={result['users']} runs={result['runs']} elapsed={result['elapsed_s']:.2f}s "
+          f"throughput={result['throughput_ops']:.0f} ops/s api_calls={result['api_calls']:.0f}")
+    print(f"per op: api_calls={result['api_calls_per_op']:.3f} cpu={result['cpu_ms_per_op']:.3f}ms")
+    print(f"{'operation':<20}{'count':>8}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for name, stat in result["latency"].items():
+        print(f"{name:<20}{stat['count']:>8}{stat['p50'] * 1000:>10.2f}{stat['p99'] * 1000:>10.2f}")
+    print(f"peak memory: traced={result['peak_traced_mb']:.1f}MB rss={result['peak_rss_mb']:.1f}MB")
+    print(f"event loop lag: p99={result['loop_lag_p99'] * 1000:.2f}ms max={result['loop_lag_max'] * 1000:.2f}ms")
+    print(f"render: {result['render']}")
+    print(f"write-behind: {result['write_behind']}")
+    print(f"pull lock: {result['pull_lock']}")
+    if result["watchdog"]:
+        print(f"loop watchdog: {result['watchdog']}")
+    if result["errors"]:
+        print(f"errors: {result['errors']}")
+    if result["mismatched_users"]:
+        print(f"users with wrong points: {result['mismatched_users']}")
+
+
+def compare(result, base, tolerance):
+    """基準値より悪化した項目の一覧を返す（ばらつきの小さい項目だけを見る）"""
+    worse = 1 + tolerance
+    problems = []
+    if result["api_calls_per_op"] > base["api_calls_per_op"] * worse:
+        problems.append(f"api calls/op {result['api_calls_per_op']:.3f} > {base['api_calls_per_op']:.3f}")
+    if result["cpu_ms_per_op"] > base["cpu_ms_per_op"] * worse + CPU_SLACK_MS:
+        problems.append(f"cpu/op {result['cpu_ms_per_op']:.3f}ms > {base['cpu_ms_per_op']:.3f}ms")
+    for name, stat in base["latency"].items():
+        now = result["latency"].get(name)
+        if now is None:
+            problems.append(f"{name}: not measured")
+        elif now["p50"] > stat["p50"] * worse + LATENCY_SLACK:
+            problems.append(f"{name} p50 {now['p50'] * 1000:.2f}ms > {stat['p50'] * 1000:.2f}ms")
+    for key in ("peak_traced_mb", "peak_rss_mb"):
+        if base.get(key) and result[key] > base[key] * worse:
+            problems.append(f"{key} {result[key]:.1f} > {base[key]:.1f}")
+    return problems
+
+
+def scenario_key(args):
+    return f"users={args.users},concurrency={args.concurrency},api_latency={args.api_latency}"
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline gacha bot benchmark")
+    parser.add_argument("--users", type=int, default=500, help="simulated users")
+    parser.add_argument("--concurrency", type=int, default=50, help="users running at the same time")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="seconds each fake Discord API call takes")
+    parser.add_argument("--runs", type=int, default=3, help="repeat the scenario and use the median")
+    parser.add_argument("--frame-delay", type=float, default=0.0, help="multiplier for reveal animation delays")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression ratio")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--allow-missing-baseline", action="store_true",
+                        help="exit 0 when there is no baseline for this scenario")
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false",
+                        help="skip tracemalloc (faster, reports RSS only)")
+    parser.add_argument("--watchdog-ms", type=float, default=0.0,
+                        help="log the loop thread stack when the loop is blocked this long")
+    parser.add_argument("--json", help="write the full result to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    if args.baseline:
+        args.baseline = os.path.abspath(args.baseline)
+    os.chdir(ROOT)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    # 1回ごとに新しいプロセス（前の回のbot・DB接続・ログ設定を持ち越さない）
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(max(1, args.runs)):
+        with context.Pool(1) as pool:
+            runs.append(pool.apply(run_once, (args,)))
+    result = summarize(runs)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+    if result["errors"] or result["mismatched_users"]:
+        print("FAILED: errors or inconsistent state")
+        return 1
+
+    baselines = load_baselines(args.baseline)
+    key = scenario_key(args)
+    if args.update_baseline:
+        baselines[key] = result
+        with open(args.baseline, "w", encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"baseline updated: {key}")
+        return 0
+    if key not in baselines:
+        print(f"no baseline for {key} (run with --update-baseline to record one)")
+        return 0 if args.allow_missing_baseline else 1
+    problems = compare(result, baselines[key], args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+
+# 通常ログ（テキスト）
+LOG_PATH = os.getenv("LOG_PATH", "bot.log")
+# ガチャ・コマンドのイベントログ（1行1JSON。排出率の監査に使う）
+EVENT_LOG_PATH = os.getenv("EVENT_LOG_PATH", "events.jsonl")
+# サイズでローテーション
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# 件数の多いイベントの記録率（0.0〜1.0）
+DRAW_LOG_SAMPLE = float(os.getenv("DRAW_LOG_SAMPLE", "1.0"))
+COMMAND_LOG_SAMPLE = float(os.getenv("COMMAND_LOG_SAMPLE", "1.0"))
+
+event_logger = logging.getLogger("gacha.events")
+
+_listeners = []
+
+
+class JsonLineFormatter(logging.Formatter):
+    """log_eventで渡したフィールドを1行のJSONにする"""
+    def format(self, record):
+        data = {"ts": round(record.created, 3), "event": record.getMessage()}
+        data.update(getattr(record, "fields", {}))
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _start_listener(logger, handlers):
+    # ログの書き込みは別スレッドで行い、イベントループでは queue に入れるだけにする
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def setup_logging(level=logging.INFO):
+    """ログ出力を設定する（起動時に1回だけ呼ぶ）"""
+    if _listeners:
+        return
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    _start_listener(root, [file_handler, stream_handler])
+
+    event_handler = logging.handlers.RotatingFileHandler(
+        EVENT_LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    event_handler.setFormatter(JsonLineFormatter())
+    event_logger.setLevel(logging.INFO)
+    event_logger.propagate = False
+    _start_listener(event_logger, [event_handler])
+
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """キューに残っているログを書き出して終了する"""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+def log_event(event, sample=1.0, **fields):
+    """
+    構造化イベントを記録する
+    sample: 記録する割合（1.0なら全件）
+    """
+    if sample < 1.0 and random.random() >= sample:
+        return
+    if sample < 1.0:
+        fields["sample"] = sample
+    event_logger.info(event, extra={"fields": fields})
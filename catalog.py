@@ -0,0 +1,312 @@
+import os
+import csv
+import io
+import copy
+import time
+import asyncio
+import hashlib
+import logging
+from functools import cached_property
+from types import MappingProxyType
+
+from sampler import AliasSampler
+import snapshot
+from pages import build_number_pages, build_chname_pages
+from progress import build_group_masks
+from search import SearchIndex
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ファイル更新チェックの間隔(秒)
+RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", "30"))
+# CSVを解析した結果のバイナリスナップショット（空文字なら使わない。未指定ならCSVのパス + .snap）
+SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT")
+# カードNo.の上限（No.は所持カードのビット位置としてDBにも保存される）
+MAX_CARD_NO = 65535
+
+
+class CatalogError(ValueError):
+    """CSVの内容が不正"""
+
+
+def detect_encoding(raw: bytes) -> str:
+    """バイト列のエンコーディングを推定する"""
+    import chardet
+    return chardet.detect(raw)['encoding'] or 'utf-8'
+
+
+def card_no_error(no, seen):
+    """No.がビット位置として使えなければ理由を返す"""
+    if not no.isdigit() or str(int(no)) != no:
+        return "0以上の整数（先頭の0なし）ではありません"
+    if int(no) > MAX_CARD_NO:
+        return f"{MAX_CARD_NO}より大きい値です"
+    if no in seen:
+        return "重複しています"
+    return None
+
+
+def parse_catalog(raw: bytes, encoding: str, skip_invalid=False):
+    """
+    CSVのバイト列をガチャデータのリストに変換する
+    No.が不正な行があれば CatalogError（skip_invalid=True ならその行を除いてエラーログに出す）
+    """
+    return _parse_rows(raw, encoding, skip_invalid)[0]
+
+
+def _parse_rows(raw, encoding, skip_invalid):
+    """(ガチャデータのリスト, 除いた行数)"""
+    text = raw.decode(encoding)
+    reader = csv.DictReader(io.StringIO(text, newline=''))
+    items = []
+    invalid = []
+    seen = set()
+    for line, row in enumerate(reader, start=2):
+        error = card_no_error(row["No."], seen)
+        if error:
+            invalid.append(f"{line}行目 No.={row['No.']!r}: {error}")
+            continue
+        seen.add(row["No."])
+        items.append(MappingProxyType({
+            "no": row["No."],
+            "url": row.get("url", ""),
+            "chname": row.get("chname", ""),
+            "rarity": row["rarity"],
+            "rate": float(row["rate"]),
+            "title": row["title"],
+        }))
+    if invalid:
+        message = "No.が不正な行があります: " + " / ".join(invalid)
+        if not skip_invalid:
+            raise CatalogError(message)
+        logger.error(f"{message}（これらの行は読み込みません）")
+    if not items:
+        raise CatalogError("ガチャデータが1件もありません")
+    if any(item["rate"] < 0 for item in items) or sum(item["rate"] for item in items) <= 0:
+        raise CatalogError("rateは0以上で、合計が0より大きい必要があります")
+    return items, len(invalid)
+
+
+class Catalog:
+    """
+    ガチャデータ一式（読み取り専用）
+    一度作成したら変更しない。更新時は新しいCatalogに差し替える。
+    """
+    def __init__(self, items, encoding, mtime, digest, sampler=None, skipped=0):
+        self.items = tuple(items)
+        self.by_no = MappingProxyType({item["no"]: item for item in self.items})
+        self.encoding = encoding
+        self.mtime = mtime
+        self.digest = digest
+        self.skipped = skipped  # CSVから除いた不正な行の数（digestはCSV全体のハッシュのまま）
+        if sampler is not None:
+            # スナップショットのテーブルを使う（cached_propertyを上書き）
+            self.__dict__["sampler"] = sampler
+
+    @property
+    def version(self):
+        return self.digest[:12]
+
+    def __len__(self):
+        return len(self.items)
+
+    @cached_property
+    def card_mask(self):
+        """全カードのビット集合（所持率の計算用）"""
+        mask = 0
+        for item in self.items:
+            mask |= 1 << int(item["no"])
+        return mask
+
+    @cached_property
+    def group_masks(self):
+        """キャラ名・レア度ごとのビット集合（達成率の計算用）"""
+        return build_group_masks(self.items)
+
+    @cached_property
+    def search_index(self):
+        """/artsearch 用のタイトル・キャラ名の索引"""
+        return SearchIndex(self.items)
+
+    @cached_property
+    def sampler(self):
+        """rate列から作るエイリアステーブル（カタログ更新時のみ再作成）"""
+        return AliasSampler([item["rate"] for item in self.items])
+
+    @cached_property
+    def pages_by_no(self):
+        """/artlistnum 用のページ（No.順）"""
+        return build_number_pages(self.items)
+
+    @cached_property
+    def pages_by_chname(self):
+        """/artlistch 用のページ（キャラ名ごと）"""
+        return build_chname_pages(self.items)
+
+    def with_mtime(self, mtime):
+        """更新時刻だけ違う同じ内容のカタログ（作成済みのテーブル・ページ・索引をそのまま使う）"""
+        new = copy.copy(self)
+        new.mtime = mtime
+        return new
+
+    def warm(self):
+        """抽選テーブル・一覧ページを作っておく（読み込みと同じスレッドで呼ぶ）"""
+        self.card_mask
+        self.group_masks
+        self.sampler.warm()
+        self.pages_by_no
+        self.pages_by_chname
+        self.search_index
+        return self
+
+    def draw(self, rng=None):
+        """rateに従ってカードを1枚抽選する"""
+        return self.items[self.sampler.draw(rng)]
+
+    def draw_many(self, k, rng=None):
+        """rateに従ってカードをk枚まとめて抽選する（rngはnumpyのGenerator）"""
+        return [self.items[i] for i in self.sampler.draw_many(k, rng)]
+
+    @classmethod
+    def from_bytes(cls, raw: bytes, mtime: float, encoding_hint=None, skip_invalid=False):
+        digest = hashlib.sha256(raw).hexdigest()
+        encoding = None
+        if encoding_hint:
+            try:
+                raw.decode(encoding_hint)
+                encoding = encoding_hint
+            except UnicodeDecodeError:
+                logger.warning(f"前回のエンコーディング {encoding_hint} で読み込めないため再判定します")
+        if encoding is None:
+            encoding = detect_encoding(raw)
+        items, skipped = _parse_rows(raw, encoding, skip_invalid)
+        return cls(items, encoding, mtime, digest, skipped=skipped)
+
+    @classmethod
+    def from_snapshot(cls, snap, mtime):
+        """mmapで開いたスナップショットから作る（CSVの解析は行わない）"""
+        return cls(snap.items(), snap.encoding, mtime, snap.digest, sampler=snap.sampler())
+
+    @classmethod
+    def from_path(cls, path, encoding_hint=None):
+        mtime = os.stat(path).st_mtime
+        with open(path, 'rb') as f:
+            raw = f.read()
+        return cls.from_bytes(raw, mtime, encoding_hint)
+
+
+class CatalogStore:
+    """
+    起動時に一度だけCSVを読み込み、全コマンドで共有するカタログ置き場。
+    ファイルのmtime/ハッシュが変わった時だけバックグラウンドで再読み込みする。
+    """
+    def __init__(self, path, interval=RELOAD_INTERVAL, snapshot_path=SNAPSHOT_PATH):
+        self.path = path
+        self.interval = interval
+        self.snapshot_path = snapshot.default_path(path) if snapshot_path is None else snapshot_path
+        self.current = None
+        self._task = None
+        self._listeners = []  # 内容が変わった時に呼ぶコルーチン関数 (new_catalog) -> None
+
+    def load(self):
+        """
+        同期的に読み込む（起動時用）
+        No.が不正な行は除いて起動する（再読み込みの時は更新自体を取りやめる）
+        CSVがない・引けるカードがない場合はカタログなし(None)のまま起動し、
+        ファイルが直ればバックグラウンドの再読み込みで読み込まれる
+        """
+        try:
+            with metrics.CATALOG_RELOAD_SECONDS.time():
+                mtime = os.stat(self.path).st_mtime
+                with open(self.path, 'rb') as f:
+                    raw = f.read()
+                self.current = self._build(raw, mtime, skip_invalid=True).warm()
+        except FileNotFoundError:
+            logger.error(f"CSVファイルが見つかりません: {self.path}（ガチャデータなしで起動します）")
+            return None
+        except CatalogError as e:
+            logger.error(f"カタログを読み込めません（ガチャデータなしで起動します）: {e}")
+            return None
+        logger.info(f"Catalog loaded: {len(self.current)} items, encoding={self.current.encoding}, version={self.current.version}")
+        return self.current
+
+    def subscribe(self, callback):
+        """カタログの内容が変わった時（ホットリロード）に呼ぶコルーチン関数を登録する"""
+        self._listeners.append(callback)
+
+    async def _notify(self, catalog):
+        for callback in self._listeners:
+            try:
+                await callback(catalog)
+            except Exception:
+                logger.exception("カタログ更新後の処理でエラーが発生しました:")
+
+    def _build(self, raw, mtime, encoding_hint=None, skip_invalid=False):
+        """同じ内容のスナップショットがあればそれを開き、なければCSVを解析してスナップショットを作る"""
+        if not self.snapshot_path:
+            return Catalog.from_bytes(raw, mtime, encoding_hint, skip_invalid)
+        snap = snapshot.open_snapshot(self.snapshot_path, hashlib.sha256(raw).hexdigest())
+        if snap is not None:
+            return Catalog.from_snapshot(snap, mtime)
+        catalog = Catalog.from_bytes(raw, mtime, encoding_hint, skip_invalid)
+        if catalog.skipped:
+            # CSVのハッシュで保存すると、次回からは検証なしで一部を除いた内容が使われてしまう
+            logger.warning(f"不正な行を除いて読み込んだため、スナップショット {self.snapshot_path} は作りません")
+            return catalog
+        try:
+            snapshot.write(catalog, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"スナップショット {self.snapshot_path} を書き込めません: {e}")
+        return catalog
+
+    def _read_if_changed(self, old):
+        mtime = os.stat(self.path).st_mtime
+        if old is not None and mtime == old.mtime:
+            return None
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        if old is not None and hashlib.sha256(raw).hexdigest() == old.digest:
+            # 内容が同じならmtimeだけ更新
+            return old.with_mtime(mtime)
+        started = time.perf_counter()
+        catalog = self._build(raw, mtime, old.encoding if old else None).warm()
+        metrics.CATALOG_RELOAD_SECONDS.observe(time.perf_counter() - started)
+        return catalog
+
+    async def refresh(self):
+        """ファイルが変更されていれば別スレッドで再読み込みして差し替える"""
+        old = self.current
+        try:
+            new = await asyncio.to_thread(self._read_if_changed, old)
+        except FileNotFoundError as e:
+            logger.error(f"CSVファイルが見つかりません: {e}")
+            return False
+        except CatalogError as e:
+            logger.error(f"カタログを更新しません（現在の内容のまま）: {e}")
+            return False
+        except Exception:
+            logger.exception("カタログ再読み込み中にエラーが発生しました:")
+            return False
+        if new is None:
+            return False
+        self.current = new
+        if old is None or new.digest != old.digest:
+            logger.info(f"Catalog reloaded: {len(new)} items, version={new.version}")
+            await self._notify(new)
+            return True
+        return False
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.refresh()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,51 @@
+"""
+シャード・複数プロセス構成の設定
+
+    1プロセスで全シャード:  SHARD_COUNT=4
+    複数プロセスに分ける:   SHARD_COUNT=4 SHARD_IDS=0,1 / SHARD_COUNT=4 SHARD_IDS=2,3
+
+SHARD_IDS を指定した場合（または SHARED_STATE=1）は、同じSQLite(WAL)を複数プロセスで
+共有する前提で動く。ポイント消費・カード追加・付与は BEGIN IMMEDIATE のトランザクションで
+DBに直接書き、メモリ上の値はキャッシュとして扱う。毎日の付与は日付ごとに1回だけ
+DBに記録できたプロセスが実行する。
+/ranking と /progress の集計は各プロセスのメモリ上にあるので、PROGRESS_SYNC_INTERVAL ごとに
+DBの全ユーザーの所持カードから作り直す（他のプロセスで引いたカードはそれまで反映されない）。
+SHARD_IDS なしで SHARED_STATE=1 にする場合は、プロセスごとに別の INSTANCE_NAME が必要
+（ジャーナルのファイル名と適用済みの番号(journal_seq)をプロセスごとに分けるため）。
+同じマシンで動かす場合は METRICS_PORT もプロセスごとに変えること。
+"""
+import os
+
+from discord.ext import commands
+
+
+def _parse_ids(text):
+    return [int(x) for x in text.replace(" ", "").split(",") if x] if text else None
+
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = _parse_ids(os.getenv("SHARD_IDS", ""))
+SHARED_STATE = bool(SHARD_IDS) or os.getenv("SHARED_STATE", "") not in ("", "0")
+# 共有モードで他プロセスの全体付与を取り込む間隔(秒)
+STATE_SYNC_INTERVAL = float(os.getenv("STATE_SYNC_INTERVAL", "5"))
+# 共有モードで図鑑の達成状況・ランキングをDBの所持カードから作り直す間隔(秒)
+PROGRESS_SYNC_INTERVAL = float(os.getenv("PROGRESS_SYNC_INTERVAL", "60"))
+
+
+def instance_name():
+    """このプロセスの名前（ジャーナル名・ジョブ実行者の記録に使う）"""
+    if SHARD_IDS:
+        return "shards-" + "-".join(str(i) for i in SHARD_IDS)
+    return os.getenv("INSTANCE_NAME", "")
+
+
+def create_bot(**options):
+    """設定に応じて Bot か AutoShardedBot を作る"""
+    if SHARD_IDS and SHARD_COUNT is None:
+        raise ValueError("SHARD_IDS requires SHARD_COUNT")
+    if SHARED_STATE and not instance_name():
+        # 名前がないと全プロセスが同じジャーナルと journal_seq を使ってしまう
+        raise ValueError("SHARED_STATE requires INSTANCE_NAME (unique per process) when SHARD_IDS is not set")
+    if SHARD_COUNT is None:
+        return commands.Bot(**options)
+    return commands.AutoShardedBot(shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **options)
@@ -2,6 +2,10 @@ import discord
 from discord.ext import commands
 import logging
 
+import db
+from points import GRANT_ADMIN
+import metrics
+
 logger = logging.getLogger(__name__)
 
 class AdminCog(commands.Cog):
@@ -14,10 +18,14 @@ class AdminCog(commands.Cog):
         if ctx.channel.name != "gacha-dev":
             await ctx.send("このコマンドは gacha-dev チャンネルでのみ使用できます。")
             return
-        self.bot.ensure_user_points(member.id)
-        old_points = self.bot.user_points[member.id]
-        new_points = min(15, old_points + pointnumber)  # 上限15pt
-        self.bot.user_points[member.id] = new_points
+        if self.bot.shared_state:
+            # 他のプロセスと同時に更新しないよう、DBのトランザクションで付与する
+            old_points, new_points, epoch = await db.run(db.add_user_points, member.id, pointnumber)
+            self.bot.points.store(member.id, new_points, epoch)
+        else:
+            self.bot.ensure_user_points(member.id)
+            old_points, new_points = self.bot.points.add(member.id, pointnumber)  # 上限15pt
+            await self.bot.save_points(member.id)
         await ctx.send(f"{member.display_name} に {pointnumber} ポイント付与しました。({old_points} -> {new_points})")
 
     @commands.command(name="addpointall")
@@ -26,15 +34,16 @@ class AdminCog(commands.Cog):
         if ctx.channel.name != "gacha-dev":
             await ctx.send("このコマンドは gacha-dev チャンネルでのみ使用できます。")
             return
-        count = 0
-        for user_id, points in self.bot.user_points.items():
-            old_points = points
-            new_points = min(15, old_points + pointnumber)  # 上限15pt
-            self.bot.user_points[user_id] = new_points
-            if new_points > old_points:
-                count += 1
+        # 付与履歴に1件追加するだけ（各ユーザーへは残高を読む時に反映される）
+        if self.bot.shared_state:
+            # epochはDBで採番し、他のプロセスは定期的な同期で取り込む
+            await db.run(db.add_grant, GRANT_ADMIN, pointnumber)
+            await self.bot.sync_grants()
+        else:
+            epoch = self.bot.points.grant_all(pointnumber, GRANT_ADMIN)
+            await self.bot.writer.submit("add_grant", epoch, GRANT_ADMIN, pointnumber)
         await ctx.send(f"全てのユーザーに {pointnumber} ポイント付与しました。(上限15まで)\n"
-                       f"ポイントが増えたユーザー数: {count}")
+                       f"対象ユーザー数: {len(self.bot.points)}")
 
     @commands.command(name="addpointauto")
     @commands.has_permissions(administrator=True)
@@ -47,9 +56,38 @@ class AdminCog(commands.Cog):
             return
         old_value = self.bot.daily_auto_points
         self.bot.daily_auto_points = pointnumber
+        await self.bot.writer.submit("set_setting", "daily_auto_points", pointnumber)
         await ctx.send(f"毎日00:00時に自動付与されるポイントを {old_value} から {pointnumber} に変更しました。\n"
                        f"次に迎える00:00から {pointnumber} ポイントが付与されます。")
         logger.info(f"Admin changed daily auto points from {old_value} to {pointnumber}")
 
+    @commands.command(name="stats")
+    @commands.has_permissions(administrator=True)
+    async def stats(self, ctx):
+        if ctx.channel.name != "gacha-dev":
+            await ctx.send("このコマンドは gacha-dev チャンネルでのみ使用できます。")
+            return
+        text = "\n".join(metrics.summary_lines())
+        # Discordのメッセージ上限に収める
+        if len(text) > 1900:
+            text = text[:1900] + "\n…"
+        await ctx.send(f"```\n{text}\n```")
+
+    @commands.command(name="reloadbanners")
+    @commands.has_permissions(administrator=True)
+    async def reloadbanners(self, ctx):
+        if ctx.channel.name != "gacha-dev":
+            await ctx.send("このコマンドは gacha-dev チャンネルでのみ使用できます。")
+            return
+        # banners.json を読み直し、抽選テーブルと開始・終了ジョブを作り直す
+        try:
+            await self.bot.reload_banners()
+        except (OSError, ValueError, KeyError) as e:
+            await ctx.send(f"banners.json の読み込みに失敗しました: {e}")
+            return
+        active = ", ".join(banner.name for banner in self.bot.banners.active.values()) or "なし"
+        await ctx.send(f"バナーを読み込みました。({len(self.bot.banners.specs)}件)\n開催中: {active}")
+        logger.info(f"Admin reloaded banners: {len(self.bot.banners.specs)} banner(s)")
+
 async def setup(bot):
     await bot.add_cog(AdminCog(bot))
@@ -1,181 +1,269 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import csv
-import chardet
-import random
-import asyncio
-import logging
+import os
 import time
-from collections import defaultdict
+import logging
+
+from botlog import log_event, DRAW_LOG_SAMPLE
+from metrics import INTERACTION_SECONDS
+from ownership import CardSet
+from progress import GROUP_CHNAME, GROUP_RARITY
+from pages import card_line
+from ratelimit import RateLimit, rate_limited, per_user, per_guild
+from render import build_reveal_frames
 
 logger = logging.getLogger(__name__)
 
 COOLDOWN = 10.0  # クールダウンが必要なら設定
+MULTI_PULL_COUNT = 10  # 10連ガチャの回数
+
+COOLDOWN_MESSAGE = "クールダウン中です。あと {remain} 秒お待ちください。"
+BUSY_MESSAGE = "ただいま混み合っています。あと {remain} 秒ほどお待ちください。"
+
+# サーバー全体の上限（1秒あたりの回数と、まとめて受け付ける回数）。サーバーの規模に合わせて環境変数で変える
+GACHA_GUILD_RATE = float(os.getenv("GACHA_GUILD_RATE", "5"))
+GACHA_GUILD_BURST = float(os.getenv("GACHA_GUILD_BURST", "20"))
+PULL_GUILD_RATE = float(os.getenv("PULL_GUILD_RATE", "10"))
+PULL_GUILD_BURST = float(os.getenv("PULL_GUILD_BURST", "40"))
+
+# /gacha: ユーザーごとのクールダウンとサーバー全体の上限
+GACHA_CMD_USER_LIMIT = RateLimit.cooldown(COOLDOWN, per_user, COOLDOWN_MESSAGE)
+GACHA_CMD_GUILD_LIMIT = RateLimit(GACHA_GUILD_RATE, GACHA_GUILD_BURST, per_guild, BUSY_MESSAGE)
+# ガチャボタン: ユーザーごと（連打対策）とサーバー全体の上限
+PULL_USER_LIMIT = RateLimit(1.0, 3, per_user, COOLDOWN_MESSAGE)
+PULL_GUILD_LIMIT = RateLimit(PULL_GUILD_RATE, PULL_GUILD_BURST, per_guild, BUSY_MESSAGE)
+
+# レア度の高い順（10連結果の代表画像選び用）
+RARITY_ORDER = {"UR": 4, "SSR": 3, "SR": 2, "R": 1, "N": 0}
+
+RANKING_SIZE = 10  # /ranking の表示件数
+SEARCH_LIMIT = 20  # /artsearch の表示件数（候補の表示はDiscordの上限の25件）
+
+# /artsearch の所持状況の絞り込み
+SEARCH_ALL = "all"
+SEARCH_OWNED = "owned"
+SEARCH_UNOWNED = "unowned"
+
+# 一覧表示のモード
+MODE_NUMBER = "num"  # No.順
+MODE_CHNAME = "ch"   # キャラ名ごと
+
+# ページ送りボタン: slot -> (ラベル, スタイル)
+PAGE_BUTTONS = {
+    "first": ("<<", discord.ButtonStyle.danger),
+    "prev": ("<", discord.ButtonStyle.secondary),
+    "next": (">", discord.ButtonStyle.success),
+    "last": (">>", discord.ButtonStyle.primary),
+}
+
+
+THREAD_PREFIX = "gacha-thread-"
+
+
+def is_gacha_thread(bot, interaction):
+    """コマンドを使えるチャンネル（登録済みのガチャスレッド）か"""
+    if interaction.channel_id in bot.threads:
+        return True
+    # 対応表ができる前に作られたスレッドは、本人が名前どおりのスレッドで使った時に登録する
+    channel = interaction.channel
+    if (isinstance(channel, discord.Thread) and interaction.guild_id is not None
+            and channel.name == f"{THREAD_PREFIX}{interaction.user.name}"
+            and bot.threads.get(interaction.guild_id, interaction.user.id) is None):
+        bot.register_thread(interaction.guild_id, interaction.user.id, channel.id, channel.parent_id)
+        return True
+    return False
+
+
+async def fetch_thread(guild, thread_id):
+    """スレッドを取得する（アーカイブ済みも含む）。削除されていればNone"""
+    thread = guild.get_thread(thread_id)
+    if thread is not None:
+        return thread
+    try:
+        return await guild.fetch_channel(thread_id)
+    except discord.NotFound:
+        return None
+
+
+def percent(owned, total):
+    return f"{owned * 100 / total:.1f}%" if total else "-"
 
-class PaginatorView(discord.ui.View):
-    def __init__(self, data, collected_cards, per_page=20):
-        super().__init__(timeout=None)
-        self.data = data
-        self.collected_cards = collected_cards
-        self.per_page = per_page
-        self.current_page = 0
-        self.total_pages = (len(data) + per_page - 1) // per_page
-
-    def get_page_content(self):
-        start_idx = self.current_page * self.per_page
-        end_idx = start_idx + self.per_page
-        page_content = []
-        for item in self.data[start_idx:end_idx]:
-            card_no = item["No."]
-            title = item["title"]
-            chname = item.get("chname", "")  # chnameを取得
-            url = item.get("url", "")
-
-            if card_no in self.collected_cards:
-                # 取得済みの場合：アイコン + カード番号 + chname + タイトル + [🔗 Link]({url})
-                line = f":ballot_box_with_check: **No.{card_no}** {chname} {title} [🔗 Link]({url})"
-            else:
-                # 未取得の場合：アイコン + カード番号 + chname + タイトル
-                line = f":blue_square: **No.{card_no}** {chname} {title}"
-            page_content.append(line)
-
-        return page_content
-
-    async def update_message(self, interaction):
-        page_content = "\n".join(self.get_page_content())
-        embed = discord.Embed(
-            title=f"{interaction.user.name}のリスト\nPage {self.current_page + 1}/{self.total_pages}",
-            description=page_content
-        )
-        await interaction.response.edit_message(embed=embed, view=self)
 
-    @discord.ui.button(label="<<", style=discord.ButtonStyle.danger)
-    async def first_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.current_page = 0
-        await self.update_message(interaction)
+def search_cards(bot, user_id, query, owned=SEARCH_ALL, limit=SEARCH_LIMIT):
+    """カタログの索引で検索する。(カードのリスト, ユーザーのCardSet) を返す"""
+    cards = bot.user_cards.get(user_id) or CardSet()
+    include = cards.bits if owned == SEARCH_OWNED else None
+    exclude = cards.bits if owned == SEARCH_UNOWNED else 0
+    return bot.catalog.current.search_index.search(query, include, exclude, limit), cards
 
-    @discord.ui.button(label="<", style=discord.ButtonStyle.secondary)
-    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.current_page > 0:
-            self.current_page -= 1
-        await self.update_message(interaction)
 
-    @discord.ui.button(label=">", style=discord.ButtonStyle.success)
-    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.current_page < self.total_pages - 1:
-            self.current_page += 1
-        await self.update_message(interaction)
+def get_pages(catalog, mode):
+    """カタログ共有のPageSetを返す"""
+    return catalog.pages_by_no if mode == MODE_NUMBER else catalog.pages_by_chname
 
-    @discord.ui.button(label=">>", style=discord.ButtonStyle.primary)
-    async def last_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.current_page = self.total_pages - 1
-        await self.update_message(interaction)
 
+def build_artlist_embed(pages, mode, page, cards, user_name):
+    description = pages.render(page, cards)
+    if mode == MODE_NUMBER:
+        title = f"{user_name}のリスト\nPage {page + 1}/{len(pages)}"
+    else:
+        title = f"{pages.label(page)} のリスト\nPage {page + 1}/{len(pages)}"
+    return discord.Embed(title=title, description=description)
 
-class ChnamePaginatorView(discord.ui.View):
+
+class ArtListPageButton(discord.ui.DynamicItem[discord.ui.Button],
+                        template=r"artlist:(?P<mode>num|ch):(?P<slot>first|prev|next|last):(?P<page>[0-9]+):(?P<owner>[0-9]+)"):
     """
-    キャラ名(chname)ごとにページを分けるビュー
-    1キャラ = 1ページ
+    一覧のページ送りボタン
+    状態（モード・移動先ページ・リストの持ち主）はすべてcustom_idに入れてあるので、
+    ビューを保持せず、再起動後も押せる。
     """
-    def __init__(self, grouped_data, collected_cards):
-        """
-        grouped_data: [(chname, [items...]), (chname2, [items...]), ...]
-        collected_cards: ユーザーが取得したカードNo.のリスト
-        """
-        super().__init__(timeout=None)
-        self.grouped_data = grouped_data
-        self.collected_cards = collected_cards
-        self.current_index = 0
-        self.total_pages = len(grouped_data)
-
-    def build_page_content(self):
-        """現在のchnameグループのページ内容を組み立て"""
-        chname, items = self.grouped_data[self.current_index]
-        lines = []
-        for item in items:
-            card_no = item["No."]
-            title = item["title"]
-            url = item.get("url", "")
-            if card_no in self.collected_cards:
-                line = f":ballot_box_with_check: **No.{card_no}** {title} [🔗 Link]({url})"
-            else:
-                line = f":blue_square: **No.{card_no}** {title}"
-            lines.append(line)
-        return chname, lines
-
-    async def update_message(self, interaction: discord.Interaction):
-        chname, lines = self.build_page_content()
-        description = "\n".join(lines)
-        embed = discord.Embed(
-            title=f"{chname} のリスト\nPage {self.current_index + 1}/{self.total_pages}",
-            description=description
-        )
-        await interaction.response.edit_message(embed=embed, view=self)
+    def __init__(self, mode, slot, page, owner_id):
+        label, style = PAGE_BUTTONS[slot]
+        super().__init__(discord.ui.Button(
+            label=label, style=style, custom_id=f"artlist:{mode}:{slot}:{page}:{owner_id}"
+        ))
+        self.mode = mode
+        self.page = page
+        self.owner_id = owner_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match["mode"], match["slot"], int(match["page"]), int(match["owner"]))
+
+    async def callback(self, interaction: discord.Interaction):
+        bot = interaction.client
+        catalog = bot.catalog.current
+        if not catalog:
+            await interaction.response.send_message("データが見つかりません。", ephemeral=True)
+            return
+        pages = get_pages(catalog, self.mode)
+        # カタログ更新でページ数が減っていても範囲内に収める
+        page = min(self.page, len(pages) - 1)
+        cards = bot.user_cards.get(self.owner_id) or CardSet()
+        embed = build_artlist_embed(pages, self.mode, page, cards, interaction.user.name)
+        await interaction.response.edit_message(embed=embed, view=ArtListView(self.mode, page, len(pages), self.owner_id))
 
-    @discord.ui.button(label="<<", style=discord.ButtonStyle.danger)
-    async def first_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.current_index = 0
-        await self.update_message(interaction)
 
-    @discord.ui.button(label="<", style=discord.ButtonStyle.secondary)
-    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.current_index > 0:
-            self.current_index -= 1
-        await self.update_message(interaction)
+class ArtListView(discord.ui.View):
+    """一覧のページ送りボタン4つ（各ボタンが移動先ページを持つ）"""
+    def __init__(self, mode, page, total_pages, owner_id):
+        super().__init__(timeout=None)
+        targets = {
+            "first": 0,
+            "prev": max(page - 1, 0),
+            "next": min(page + 1, total_pages - 1),
+            "last": total_pages - 1,
+        }
+        for slot, target in targets.items():
+            self.add_item(ArtListPageButton(mode, slot, target, owner_id))
 
-    @discord.ui.button(label=">", style=discord.ButtonStyle.success)
-    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if self.current_index < self.total_pages - 1:
-            self.current_index += 1
-        await self.update_message(interaction)
 
-    @discord.ui.button(label=">>", style=discord.ButtonStyle.primary)
-    async def last_page(self, interaction: discord.Interaction, button: discord.ui.Button):
-        self.current_index = self.total_pages - 1
-        await self.update_message(interaction)
+def pull_message(banner, points):
+    return f"【{banner.name}】\n下のボタンを押してガチャを回してください。\n残りポイント: {points} pt"
 
 
 class GachaButtonView(discord.ui.View):
-    def __init__(self, bot, user_id):
+    def __init__(self, bot, user_id, banner_id):
         super().__init__(timeout=None)
         self.bot = bot
         self.user_id = user_id
+        self.banner_id = banner_id
+
+    async def current_banner(self, interaction):
+        """ボタンを押した時点で開催中ならそのバナー（期間が終わっていたらNone）"""
+        banner = self.bot.banners.get(self.banner_id)
+        if banner is None:
+            await interaction.followup.send("このガチャの開催期間は終了しました。/gacha で開き直してください。", ephemeral=True)
+        return banner
 
     @discord.ui.button(label="ガチャを回す！", style=discord.ButtonStyle.primary)
+    @rate_limited(PULL_USER_LIMIT, PULL_GUILD_LIMIT)
     async def gacha_button_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
+        started = time.perf_counter()
         await interaction.response.defer()
+        deferred = time.perf_counter()
+        INTERACTION_SECONDS.observe(deferred - started, "gacha_button", "defer")
         user_id = interaction.user.id
-        self.bot.ensure_user_points(user_id)
-        points = self.bot.user_points[user_id]
-        if points <= 0:
-            await interaction.followup.send("ポイントが不足しています。", ephemeral=True)
+        banner = await self.current_banner(interaction)
+        if banner is None:
             return
 
-        # ポイント消費
-        self.bot.user_points[user_id] = points - 1
-        remaining_points = self.bot.user_points[user_id]
-
-        # エフェメラルメッセージの残りポイント更新
-        await interaction.edit_original_response(
-            content=f"下のボタンを押してガチャを回してください。\n残りポイント: {remaining_points} pt"
-        )
-
-        # 抽選
-        url_info = await self.get_random_url(user_id)
-        if url_info is None:
-            await interaction.followup.send("ガチャデータの読み込みに失敗しました。", ephemeral=True)
+        # ポイント消費・抽選・カード追加をまとめて実行
+        pull = await self.bot.pulls.pull(user_id, 1, banner)
+        drawn = time.perf_counter()
+        INTERACTION_SECONDS.observe(drawn - deferred, "gacha_button", "draw")
+        if pull is None:
+            await interaction.followup.send("ポイントが不足しています。", ephemeral=True)
             return
+        remaining_points = pull.remaining_points
+        item, is_new = pull.results[0]
+        url_info = dict(item, rarity=self.add_emoji_to_rarity(item["rarity"]))
 
-        logger.info(f"User {interaction.user.name} (ID: {user_id}) drew card {url_info['no']} - {url_info['title']} (rarity: {url_info['rarity']})")
+        # エフェメラルメッセージの残りポイント更新
+        await interaction.edit_original_response(content=pull_message(banner, remaining_points))
 
-        # 未取得ならカード追加
-        is_new = url_info["no"] not in self.bot.user_cards.get(user_id, [])
-        if is_new:
-            self.bot.user_cards.setdefault(user_id, []).append(url_info["no"])
+        log_event("draw", sample=DRAW_LOG_SAMPLE, user=interaction.user.name, user_id=user_id,
+                  card=item["no"], rarity=item["rarity"], chname=item["chname"], new=is_new, count=1,
+                  banner=banner.id, remaining=remaining_points,
+                  latency_ms=round((time.perf_counter() - started) * 1000, 1))
 
         # ガチャ結果をアニメーション風に表示
-        await self.animate_embed(interaction, url_info, remaining_points, is_new)
+        await self.animate_embed(interaction, url_info, remaining_points, is_new, banner.name)
+        finished = time.perf_counter()
+        INTERACTION_SECONDS.observe(finished - drawn, "gacha_button", "animation")
+        INTERACTION_SECONDS.observe(finished - started, "gacha_button", "total")
+
+    @discord.ui.button(label=f"{MULTI_PULL_COUNT}連ガチャを回す！", style=discord.ButtonStyle.success)
+    @rate_limited(PULL_USER_LIMIT, PULL_GUILD_LIMIT)
+    async def multi_gacha_button_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
+        started = time.perf_counter()
+        await interaction.response.defer()
+        deferred = time.perf_counter()
+        INTERACTION_SECONDS.observe(deferred - started, "multi_gacha_button", "defer")
+        user_id = interaction.user.id
+        count = MULTI_PULL_COUNT
+        banner = await self.current_banner(interaction)
+        if banner is None:
+            return
+
+        # ポイントはまとめて1回で消費し、まとめて抽選・カード追加
+        pull = await self.bot.pulls.pull(user_id, count, banner)
+        drawn = time.perf_counter()
+        INTERACTION_SECONDS.observe(drawn - deferred, "multi_gacha_button", "draw")
+        if pull is None:
+            await interaction.followup.send(f"ポイントが不足しています。({count}連には{count}pt必要です)", ephemeral=True)
+            return
+        remaining_points = pull.remaining_points
+        results = pull.results
+
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        for item, is_new in results:
+            log_event("draw", sample=DRAW_LOG_SAMPLE, user=interaction.user.name, user_id=user_id,
+                      card=item["no"], rarity=item["rarity"], chname=item["chname"], new=is_new, count=count,
+                      banner=banner.id, remaining=remaining_points, latency_ms=latency_ms)
+
+        await interaction.edit_original_response(content=pull_message(banner, remaining_points))
+        await self.bot.renderer.send(interaction, embed=self.build_multi_embed(results, remaining_points, banner.name))
+        finished = time.perf_counter()
+        INTERACTION_SECONDS.observe(finished - drawn, "multi_gacha_button", "animation")
+        INTERACTION_SECONDS.observe(finished - started, "multi_gacha_button", "total")
+
+    def build_multi_embed(self, results, remaining_points, title):
+        """10連の結果を1つのEmbedにまとめる"""
+        lines = []
+        for item, is_new in results:
+            line = f"{self.add_emoji_to_rarity(item['rarity'])} **No.{item['no']}** {item['chname']} {item['title']}"
+            if is_new:
+                line += " ✨NEW✨"
+            lines.append(line)
+        embed = discord.Embed(title=f"{title} {len(results)}連", description="\n".join(lines))
+        # 一番レア度の高いカードを代表画像にする
+        best, _ = max(results, key=lambda r: RARITY_ORDER.get(r[0]["rarity"], -1))
+        embed.set_image(url=best["url"])
+        embed.add_field(name="残りポイント", value=f"**{remaining_points} pt**", inline=False)
+        return embed
 
     def add_emoji_to_rarity(self, rarity):
         if rarity == "N":
@@ -190,68 +278,11 @@ class GachaButtonView(discord.ui.View):
             return "🎇✨✨🌟💎 UR 💎🌟✨✨🎇"
         return rarity
 
-    async def get_random_url(self, user_id):
-        gacha_data = []
-        try:
-            with open(self.bot.gacha_data_path, 'rb') as f:
-                result = chardet.detect(f.read())
-            encoding = result['encoding']
-            with open(self.bot.gacha_data_path, newline='', encoding=encoding) as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    gacha_data.append({
-                        "url": row["url"],
-                        "chname": row["chname"],
-                        "rarity": self.add_emoji_to_rarity(row["rarity"]),
-                        "rate": float(row["rate"]),
-                        "no": row["No."],
-                        "title": row["title"]
-                    })
-        except FileNotFoundError as e:
-            logger.error(f"CSVファイルが見つかりません: {e}")
-            return None
-        except Exception:
-            logger.exception("CSV読み込み中にエラーが発生しました:")
-            return None
-
-        if not gacha_data:
-            return None
-
-        total_rate = sum(item["rate"] for item in gacha_data)
-        random_value = random.uniform(0, total_rate)
-        current_rate = 0
-        for item in gacha_data:
-            current_rate += item["rate"]
-            if random_value <= current_rate:
-                return item
-        return gacha_data[-1]
-
-    async def animate_embed(self, interaction, url_info, remaining_points, is_new):
-        message = await interaction.followup.send("ガチャ中…", ephemeral=False)
-        await asyncio.sleep(1)
-        embed = discord.Embed(title="バレンタインガチャ")
-        await message.edit(content=None, embed=embed)
-        await asyncio.sleep(1)
-
-        embed.add_field(name="キャラ", value=url_info['chname'], inline=True)
-        await message.edit(embed=embed)
-        await asyncio.sleep(1)
-
-        embed.add_field(name="レア度", value=url_info['rarity'], inline=True)
-        embed.add_field(name="イラストNo.", value=f"No.{url_info['no']}", inline=True)
-        if is_new:
-            embed.add_field(name="\u200b", value="✨NEW✨", inline=True)
-        embed.add_field(name="タイトル", value=url_info['title'], inline=True)
-        await message.edit(embed=embed)
-        await asyncio.sleep(1)
-
-        embed.add_field(name="URL", value=url_info['url'], inline=False)
-        embed.set_image(url=url_info['url'])
-        await message.edit(embed=embed)
-        await asyncio.sleep(1)
-
-        embed.add_field(name="残りポイント", value=f"**{remaining_points} pt**", inline=False)
-        await message.edit(embed=embed)
+    async def animate_embed(self, interaction, url_info, remaining_points, is_new, title):
+        # 演出はRevealSchedulerに任せる（混雑時はフレームを間引く）
+        result = dict(url_info, is_new=is_new, remaining_points=remaining_points)
+        frames = build_reveal_frames(result, title)
+        await self.bot.renderer.reveal(interaction, frames)
 
 
 class GachaCog(commands.Cog):
@@ -259,51 +290,67 @@ class GachaCog(commands.Cog):
         self.bot = bot
 
     @app_commands.command(name="gacha", description="ガチャを回します")
-    async def gacha_cmd(self, interaction: discord.Interaction):
+    @app_commands.describe(banner="回すガチャ（省略時は開催中のおすすめ）")
+    @rate_limited(GACHA_CMD_USER_LIMIT, GACHA_CMD_GUILD_LIMIT)
+    async def gacha_cmd(self, interaction: discord.Interaction, banner: str = None):
         user_id = interaction.user.id
-        now = time.time()
-        last_time = self.bot.last_gacha_usage.get(user_id, 0)
-        if now - last_time < COOLDOWN:
-            remain = int(COOLDOWN - (now - last_time))
-            await interaction.response.send_message(
-                f"クールダウン中です。あと {remain} 秒お待ちください。",
-                ephemeral=True
-            )
-            return
-        self.bot.last_gacha_usage[user_id] = now
-
+        await self.bot.refresh_user(user_id)
         self.bot.ensure_user_points(user_id)
 
-        if isinstance(interaction.channel, discord.Thread) and interaction.channel.name.startswith('gacha-thread-'):
-            points = self.bot.user_points[user_id]
-            view = GachaButtonView(self.bot, user_id)
-            await interaction.response.send_message(
-                f"下のボタンを押してガチャを回してください。\n残りポイント: {points} pt",
-                view=view,
-                ephemeral=True
-            )
+        if is_gacha_thread(self.bot, interaction):
+            selected = self.bot.banners.get(banner)
+            if selected is None:
+                await interaction.response.send_message("開催中のガチャがありません。", ephemeral=True)
+                return
+            points = self.bot.points.get(user_id)
+            view = GachaButtonView(self.bot, user_id, selected.id)
+            await interaction.response.send_message(pull_message(selected, points), view=view, ephemeral=True)
         else:
             await interaction.response.send_message(
                 "このコマンドは専用のガチャスレッド内でのみ使用できます。",
                 ephemeral=True
             )
 
+    @gacha_cmd.autocomplete("banner")
+    async def gacha_banner_autocomplete(self, interaction: discord.Interaction, current: str):
+        # 開催中のバナーだけを候補に出す
+        return [
+            app_commands.Choice(name=banner.name[:100], value=banner.id)
+            for banner in self.bot.banners.active.values()
+            if current in banner.name or current in banner.id
+        ][:25]
+
     @app_commands.command(name="creategachathread", description="専用ガチャスレッドを作成します")
     async def create_gacha_thread(self, interaction: discord.Interaction):
         if interaction.channel.name != "gacha-channel":
             await interaction.response.send_message("このコマンドは専用のガチャチャンネルでのみ使用できます。", ephemeral=True)
             return
 
-        existing_thread = discord.utils.get(interaction.channel.threads, name=f'gacha-thread-{interaction.user.name}')
+        user_id = interaction.user.id
+        thread_id = self.bot.threads.get(interaction.guild_id, user_id)
+        if thread_id is None:
+            # 対応表ができる前に作られたスレッド
+            legacy = discord.utils.get(interaction.channel.threads, name=f'{THREAD_PREFIX}{interaction.user.name}')
+            if legacy:
+                self.bot.register_thread(interaction.guild_id, user_id, legacy.id, interaction.channel.id)
+                thread_id = legacy.id
+        existing_thread = await fetch_thread(interaction.guild, thread_id) if thread_id is not None else None
+        if thread_id is not None and existing_thread is None:
+            # 削除済みのスレッドは登録を消して作り直す
+            self.bot.unregister_thread(thread_id)
+
         if existing_thread:
+            if getattr(existing_thread, "archived", False):
+                await existing_thread.edit(archived=False)
             await interaction.response.send_message("すでにあなたのためのgacha-threadが存在します。", ephemeral=True)
         else:
             gacha_thread = await interaction.channel.create_thread(
-                name=f'gacha-thread-{interaction.user.name}',
+                name=f'{THREAD_PREFIX}{interaction.user.name}',
                 type=discord.ChannelType.private_thread,
                 auto_archive_duration=10080,
                 invitable=False
             )
+            self.bot.register_thread(interaction.guild_id, user_id, gacha_thread.id, interaction.channel.id)
             await gacha_thread.add_user(interaction.user)
             await gacha_thread.edit(slowmode_delay=10)
             await gacha_thread.send(
@@ -316,50 +363,22 @@ class GachaCog(commands.Cog):
     # /artlistnum: カードNo.順
     @app_commands.command(name="artlistnum", description="取得したカードの一覧をNo.順で表示します")
     async def artlist_num(self, interaction: discord.Interaction):
+        await self.bot.refresh_user(interaction.user.id)
         self.bot.ensure_user_points(interaction.user.id)
-        if isinstance(interaction.channel, discord.Thread) and interaction.channel.name.startswith('gacha-thread-'):
+        if is_gacha_thread(self.bot, interaction):
             user_id = interaction.user.id
-            collected_cards = self.bot.user_cards.get(user_id, [])
-            gacha_data = []
-            try:
-                with open(self.bot.gacha_data_path, 'rb') as f:
-                    result = chardet.detect(f.read())
-                encoding = result['encoding']
-                with open(self.bot.gacha_data_path, newline='', encoding=encoding) as csvfile:
-                    reader = csv.DictReader(csvfile)
-                    for row in reader:
-                        # chnameも取得
-                        gacha_data.append({
-                            "No.": row["No."],
-                            "title": row["title"],
-                            "url": row.get("url", ""),
-                            "chname": row.get("chname", "")
-                        })
-            except FileNotFoundError as e:
-                logger.error(f"CSVファイルが見つかりません: {e}")
-                await interaction.response.send_message("データファイルが見つかりません。管理者に連絡してください。", ephemeral=True)
-                return
-            except Exception:
-                logger.exception("CSV読み込み中にエラーが発生しました:")
-                await interaction.response.send_message("内部エラーが発生しました。管理者に連絡してください。", ephemeral=True)
-                return
-
-            if not gacha_data:
+            collected_cards = self.bot.user_cards.get(user_id) or CardSet()
+            catalog = self.bot.catalog.current
+            if not catalog:
                 await interaction.response.send_message("データが見つかりません。", ephemeral=True)
                 return
 
-            # No.順にソート
-            def safe_int(x):
-                try:
-                    return int(x)
-                except:
-                    return 999999
-            gacha_data.sort(key=lambda item: safe_int(item["No."]))
-
-            view = PaginatorView(gacha_data, collected_cards)
+            # No.順のページはカタログごとに作成済みのものを使う
+            pages = get_pages(catalog, MODE_NUMBER)
+            view = ArtListView(MODE_NUMBER, 0, len(pages), user_id)
             embed = discord.Embed(
                 title=f"{interaction.user.name}のリスト(No.順)\nPage 1",
-                description="\n".join(view.get_page_content())
+                description=pages.render(0, collected_cards)
             )
             await interaction.response.send_message(embed=embed, view=view)
         else:
@@ -368,58 +387,116 @@ class GachaCog(commands.Cog):
     # /artlistch: キャラ名ごと
     @app_commands.command(name="artlistch", description="取得したカードをキャラごとにページを分けて表示します")
     async def artlist_ch(self, interaction: discord.Interaction):
+        await self.bot.refresh_user(interaction.user.id)
         self.bot.ensure_user_points(interaction.user.id)
-        if isinstance(interaction.channel, discord.Thread) and interaction.channel.name.startswith('gacha-thread-'):
+        if is_gacha_thread(self.bot, interaction):
             user_id = interaction.user.id
-            collected_cards = self.bot.user_cards.get(user_id, [])
-            gacha_data = []
-            try:
-                with open(self.bot.gacha_data_path, 'rb') as f:
-                    result = chardet.detect(f.read())
-                encoding = result['encoding']
-                with open(self.bot.gacha_data_path, newline='', encoding=encoding) as csvfile:
-                    reader = csv.DictReader(csvfile)
-                    for row in reader:
-                        gacha_data.append({
-                            "No.": row["No."],
-                            "title": row["title"],
-                            "url": row.get("url", ""),
-                            "chname": row.get("chname", "")
-                        })
-            except FileNotFoundError as e:
-                logger.error(f"CSVファイルが見つかりません: {e}")
-                await interaction.response.send_message("データファイルが見つかりません。管理者に連絡してください。", ephemeral=True)
-                return
-            except Exception:
-                logger.exception("CSV読み込み中にエラーが発生しました:")
-                await interaction.response.send_message("内部エラーが発生しました。管理者に連絡してください。", ephemeral=True)
-                return
-
-            if not gacha_data:
+            collected_cards = self.bot.user_cards.get(user_id) or CardSet()
+            catalog = self.bot.catalog.current
+            if not catalog:
                 await interaction.response.send_message("データが見つかりません。", ephemeral=True)
                 return
 
-            # chname でグループ化
-            grouped = defaultdict(list)
-            for item in gacha_data:
-                ch = item["chname"]
-                grouped[ch].append(item)
-
-            # chname順にソート
-            grouped_data = sorted(grouped.items(), key=lambda x: x[0])  # [(chname, [items...]), ...]
-
-            view = ChnamePaginatorView(grouped_data, collected_cards)
+            # chnameごと（chname順）のページはカタログごとに作成済みのものを使う
+            pages = get_pages(catalog, MODE_CHNAME)
+            view = ArtListView(MODE_CHNAME, 0, len(pages), user_id)
             # 最初のページ
-            chname, lines = view.build_page_content()
-            description = "\n".join(lines)
             embed = discord.Embed(
-                title=f"{interaction.user.name}のリスト(chname順) - {chname}\nPage 1/{view.total_pages}",
-                description=description
+                title=f"{interaction.user.name}のリスト(chname順) - {pages.label(0)}\nPage 1/{len(pages)}",
+                description=pages.render(0, collected_cards)
             )
             await interaction.response.send_message(embed=embed, view=view)
         else:
             await interaction.response.send_message("このコマンドは専用のガチャスレッド内でのみ使用できます。", ephemeral=True)
 
 
+    # /artsearch: タイトル・キャラ名・No.で検索
+    @app_commands.command(name="artsearch", description="カードをタイトル・キャラ名で検索します")
+    @app_commands.describe(query="タイトル・キャラ名・No.（一部でも可）", owned="所持状況で絞り込み")
+    @app_commands.choices(owned=[
+        app_commands.Choice(name="すべて", value=SEARCH_ALL),
+        app_commands.Choice(name="取得済み", value=SEARCH_OWNED),
+        app_commands.Choice(name="未取得", value=SEARCH_UNOWNED),
+    ])
+    async def artsearch(self, interaction: discord.Interaction, query: str, owned: str = SEARCH_ALL):
+        await self.bot.refresh_user(interaction.user.id)
+        if not is_gacha_thread(self.bot, interaction):
+            await interaction.response.send_message("このコマンドは専用のガチャスレッド内でのみ使用できます。", ephemeral=True)
+            return
+        if not self.bot.catalog.current:
+            await interaction.response.send_message("データが見つかりません。", ephemeral=True)
+            return
+        results, cards = search_cards(self.bot, interaction.user.id, query, owned)
+        if not results:
+            await interaction.response.send_message(f"「{query}」に一致するカードはありません。", ephemeral=True)
+            return
+        embed = discord.Embed(
+            title=f"「{query}」の検索結果 ({len(results)}件)",
+            description="\n".join(card_line(item, item["no"] in cards) for item in results),
+        )
+        # 1件だけで取得済みなら画像も表示する
+        if len(results) == 1 and results[0]["no"] in cards:
+            embed.set_image(url=results[0]["url"])
+        await interaction.response.send_message(embed=embed)
+
+    @artsearch.autocomplete("query")
+    async def artsearch_autocomplete(self, interaction: discord.Interaction, current: str):
+        # 候補はDiscordの応答期限内に返す必要があるので、メモリ上の索引だけを使う
+        started = time.perf_counter()
+        if not self.bot.catalog.current or interaction.channel_id not in self.bot.threads:
+            return []
+        owned = getattr(interaction.namespace, "owned", None) or SEARCH_ALL
+        results, cards = search_cards(self.bot, interaction.user.id, current, owned, limit=25)
+        choices = [
+            app_commands.Choice(
+                name=f"{'✅' if item['no'] in cards else '⬜'} No.{item['no']} {item['chname']} {item['title']}"[:100],
+                value=item["no"])
+            for item in results
+        ]
+        INTERACTION_SECONDS.observe(time.perf_counter() - started, "artsearch", "autocomplete")
+        return choices
+
+    # /progress: 図鑑の達成率
+    @app_commands.command(name="progress", description="カードの収集率を表示します")
+    async def progress(self, interaction: discord.Interaction):
+        await self.bot.refresh_user(interaction.user.id)
+        if not is_gacha_thread(self.bot, interaction):
+            await interaction.response.send_message("このコマンドは専用のガチャスレッド内でのみ使用できます。", ephemeral=True)
+            return
+        stats = self.bot.progress.progress(interaction.user.id)
+        if not stats.total:
+            await interaction.response.send_message("データが見つかりません。", ephemeral=True)
+            return
+        rank = f"{stats.rank}位" if stats.rank else "-"
+        embed = discord.Embed(
+            title=f"{interaction.user.name}の収集率",
+            description=f"**{stats.owned}/{stats.total}** ({percent(stats.owned, stats.total)}) ランキング: {rank}",
+        )
+        rarities = sorted(((key[1], counts) for key, counts in stats.groups.items() if key[0] == GROUP_RARITY),
+                          key=lambda row: RARITY_ORDER.get(row[0], -1), reverse=True)
+        chnames = sorted((key[1], counts) for key, counts in stats.groups.items() if key[0] == GROUP_CHNAME)
+        for field_name, rows in (("レア度別", rarities), ("キャラ別", chnames)):
+            embed.add_field(name=field_name, value="\n".join(
+                f"{name}: {owned}/{size} ({percent(owned, size)})" for name, (owned, size) in rows), inline=True)
+        await interaction.response.send_message(embed=embed)
+
+    # /ranking: 所持数ランキング
+    @app_commands.command(name="ranking", description="カード所持数のランキングを表示します")
+    async def ranking(self, interaction: discord.Interaction):
+        if not is_gacha_thread(self.bot, interaction):
+            await interaction.response.send_message("このコマンドは専用のガチャスレッド内でのみ使用できます。", ephemeral=True)
+            return
+        top = self.bot.progress.top(RANKING_SIZE)
+        total = self.bot.progress.progress(interaction.user.id).total
+        lines = [f"**{rank}位** <@{user_id}> {score}/{total}" for rank, user_id, score in top]
+        rank = self.bot.progress.rank(interaction.user.id)
+        lines.append(f"\nあなた: {rank}位" if rank else "\nあなた: -")
+        embed = discord.Embed(title="カード所持数ランキング", description="\n".join(lines))
+        # メンションで通知しない
+        await interaction.response.send_message(embed=embed, allowed_mentions=discord.AllowedMentions.none())
+
+
 async def setup(bot):
+    # ページ送りボタンは起動時に一度だけ登録する（custom_idから状態を復元）
+    bot.add_dynamic_items(ArtListPageButton)
     await bot.add_cog(GachaCog(bot))
@@ -1,13 +1,68 @@
 import os
+import time
 import sqlite3
+import hashlib
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from ownership import CardSet
+from points import apply_grant, GRANT_DAILY, GRANT_ADMIN
+from sampler import AliasSampler
 
 logger = logging.getLogger(__name__)
 
 DB_PATH = os.getenv("DB_PATH", "/data/db.sqlite")
 
+INITIAL_POINTS = 15  # 新規ユーザーの初期ポイント
+POINT_CAP = 15       # ポイント上限
+
+# 接続は1本だけ作り、専用スレッドからのみ使う
+_conn = None
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+# gacha_items とそのエイリアステーブルのキャッシュ（カタログの取り込みで内容が変わったら破棄）
+_item_cache = None
+
+ITEM_COLUMNS = ("no", "url", "chname", "rarity", "rate", "title")
+_MISSING = object()
+
+def get_connection():
+    """長寿命の接続を返す（初回のみ作成してPRAGMAを設定）"""
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000")
+        conn.execute("PRAGMA mmap_size=67108864")
+        _conn = conn
+    return _conn
+
+def close():
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+def _log_error(fut):
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.error("DB処理中にエラーが発生しました:", exc_info=fut.exception())
+
+def submit(func, *args):
+    """DB処理を専用スレッドに投入する。投入順に実行される。"""
+    fut = asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    fut.add_done_callback(_log_error)
+    return fut
+
+async def run(func, *args):
+    """DB処理を専用スレッドで実行して結果を待つ（イベントループはブロックしない）"""
+    return await submit(func, *args)
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     # ユーザーポイントテーブル
     cursor.execute("""
@@ -17,6 +72,21 @@ def init_db():
     );
     """)
 
+    # 旧DBには精算済みepoch列がないので追加する
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(user_points)")]
+    if "epoch" not in columns:
+        cursor.execute("ALTER TABLE user_points ADD COLUMN epoch INTEGER NOT NULL DEFAULT 0")
+
+    # 全体付与の履歴（epoch = 付与の通し番号）
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS point_grants (
+        epoch INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        granted_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
     # ユーザーカードテーブル
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS user_cards (
@@ -26,6 +96,14 @@ def init_db():
     );
     """)
 
+    # ユーザー所持カード（ビットセットをBLOBで保存）
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_collections (
+        user_id INTEGER PRIMARY KEY,
+        bits BLOB NOT NULL
+    );
+    """)
+
     # ガチャデータテーブル
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS gacha_items (
@@ -37,127 +115,370 @@ def init_db():
         title TEXT
     );
     """)
+
+    # 各行の内容のハッシュ（CSVとの差分取り込み用）
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(gacha_items)")]
+    if "row_hash" not in columns:
+        cursor.execute("ALTER TABLE gacha_items ADD COLUMN row_hash TEXT")
+
+    # 設定値テーブル（毎日の自動付与ポイントなど）
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """)
+
+    # ユーザー専用ガチャスレッドの対応表
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS gacha_threads (
+        thread_id INTEGER PRIMARY KEY,
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        parent_id INTEGER,
+        archived INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_gacha_threads_user ON gacha_threads(guild_id, user_id)")
+
+    # 定期ジョブの実行記録（複数プロセスのうち1つだけが実行するため）
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS job_runs (
+        job TEXT NOT NULL,
+        run_key TEXT NOT NULL,
+        holder TEXT,
+        ran_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY(job, run_key)
+    );
+    """)
     conn.commit()
-    conn.close()
     logger.info("Database initialized.")
 
-def load_gacha_data(csv_path):
-    """CSVからgacha_itemsテーブルへデータを読み込む。
-       既に同じNoが存在する場合はスキップする。
+def row_hash(item):
+    """カード1行分の内容のハッシュ"""
+    data = "\x1f".join(repr(item[col]) if col == "rate" else str(item[col]) for col in ITEM_COLUMNS)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+def import_catalog(catalog):
+    """
+    カタログ(catalog.Catalog)を gacha_items に差分で取り込む
+    行ごとのハッシュを比べ、追加・更新・削除をそれぞれexecutemanyで1トランザクションにまとめる。
+    取り込んだカタログのバージョンは settings の catalog_version に記録する。
+    (追加数, 更新数, 削除数) を返す（同じバージョンなら何もしない）
     """
-    import csv
-    import chardet
+    conn = get_connection()
+    if get_setting("catalog_version") == catalog.version:
+        return 0, 0, 0
+    started = time.perf_counter()
+    stored = dict(conn.execute("SELECT no, row_hash FROM gacha_items"))
+    inserts, updates = [], []
+    for item in catalog.items:
+        digest = row_hash(item)
+        # 以前の形式で取り込まれた行はrow_hashがNULLなので更新になる
+        old = stored.pop(item["no"], _MISSING)
+        if old == digest:
+            continue
+        row = tuple(item[col] for col in ITEM_COLUMNS) + (digest,)
+        (inserts if old is _MISSING else updates).append(row)
+    # storedに残ったものはCSVから消えたカード
+    deletes = [(no,) for no in stored]
+    with conn:
+        conn.executemany("""
+        INSERT INTO gacha_items (no, url, chname, rarity, rate, title, row_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, inserts)
+        conn.executemany("""
+        UPDATE gacha_items SET url=?, chname=?, rarity=?, rate=?, title=?, row_hash=? WHERE no=?
+        """, [row[1:] + (row[0],) for row in updates])
+        conn.executemany("DELETE FROM gacha_items WHERE no=?", deletes)
+        _set_setting(conn, "catalog_version", catalog.version)
+    if inserts or updates or deletes:
+        invalidate_item_cache()
+    logger.info(f"Catalog {catalog.version} imported: {len(inserts)} added, {len(updates)} updated, "
+                f"{len(deletes)} removed in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return len(inserts), len(updates), len(deletes)
+
+def load_gacha_data(csv_path):
+    """CSVからgacha_itemsテーブルへデータを読み込む（変更のあった行だけを反映する）"""
+    from catalog import Catalog
 
     if not os.path.exists(csv_path):
         logger.error(f"CSVファイルが見つかりません: {csv_path}")
-        return
+        return None
+    return import_catalog(Catalog.from_path(csv_path))
 
-    # エンコーディング検出
-    with open(csv_path, 'rb') as f:
-        result = chardet.detect(f.read())
-    encoding = result['encoding']
+def invalidate_item_cache():
+    global _item_cache
+    _item_cache = None
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def load_state():
+    """起動時に全ユーザーのポイント・カードと全体付与の履歴を読み込む"""
+    conn = get_connection()
+    points = {user_id: (pt, epoch) for user_id, pt, epoch in conn.execute("SELECT user_id, points, epoch FROM user_points")}
+    grants = [(kind, amount) for kind, amount in conn.execute("SELECT kind, amount FROM point_grants ORDER BY epoch")]
+    cards = _load_collections(conn)
+    logger.info(f"State loaded: {len(points)} users, {len(cards)} collections, {len(grants)} grants")
+    return points, cards, grants
+
+def _load_collections(conn):
+    cards = {user_id: CardSet.from_bytes(bits) for user_id, bits in conn.execute("SELECT user_id, bits FROM user_collections")}
+    # 旧形式(user_cards)の行も取り込む
+    for user_id, card_no in conn.execute("SELECT user_id, card_no FROM user_cards"):
+        cards.setdefault(user_id, CardSet()).add(card_no)
+    return cards
+
+def load_collections():
+    """全ユーザーの所持カード（複数プロセス時に図鑑・ランキングを作り直す用）"""
+    return _load_collections(get_connection())
+
+def load_threads():
+    """[(thread_id, guild_id, user_id, archived), ...]"""
+    return get_connection().execute("SELECT thread_id, guild_id, user_id, archived FROM gacha_threads").fetchall()
+
+def get_setting(key: str, default=None):
+    row = get_connection().execute("SELECT value FROM settings WHERE key=?", (key,)).fetchone()
+    return row[0] if row else default
+
+# --- 書き込み処理（commitしない版）。まとめて1トランザクションで実行できる ---
+
+def _set_setting(conn, key, value):
+    conn.execute("""
+    INSERT INTO settings(key, value) VALUES(?, ?)
+    ON CONFLICT(key) DO UPDATE SET value=excluded.value
+    """, (key, str(value)))
+
+def _set_points(conn, user_id, points, epoch=0):
+    conn.execute("""
+    INSERT INTO user_points(user_id, points, epoch) VALUES(?,?,?)
+    ON CONFLICT(user_id) DO UPDATE SET points=excluded.points, epoch=excluded.epoch
+    """, (user_id, points, epoch))
 
-    with open(csv_path, newline='', encoding=encoding) as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            no = row["No."]
-            url = row["url"]
-            chname = row["chname"]
-            rarity = row["rarity"]
-            rate = float(row["rate"])
-            title = row["title"]
-
-            # 既存データがある場合はスキップ（初回起動時のみ実行想定）
-            cursor.execute("SELECT no FROM gacha_items WHERE no=?", (no,))
-            if cursor.fetchone():
-                continue
-
-            cursor.execute("""
-            INSERT INTO gacha_items (no, url, chname, rarity, rate, title)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """, (no, url, chname, rarity, rate, title))
+def _add_grant(conn, epoch, kind, amount):
+    conn.execute("INSERT OR IGNORE INTO point_grants(epoch, kind, amount) VALUES(?,?,?)", (epoch, kind, amount))
 
+def _add_cards(conn, user_id, card_nos):
+    conn.executemany("INSERT OR IGNORE INTO user_cards (user_id, card_no) VALUES (?,?)",
+                     [(user_id, card_no) for card_no in card_nos])
+
+def _set_collection(conn, user_id, bits_hex):
+    conn.execute("""
+    INSERT INTO user_collections(user_id, bits) VALUES(?,?)
+    ON CONFLICT(user_id) DO UPDATE SET bits=excluded.bits
+    """, (user_id, bytes.fromhex(bits_hex)))
+
+def _set_thread(conn, guild_id, user_id, thread_id, parent_id=None):
+    # 同じユーザーの古いスレッドは置き換える
+    conn.execute("DELETE FROM gacha_threads WHERE (guild_id=? AND user_id=?) OR thread_id=?",
+                 (guild_id, user_id, thread_id))
+    conn.execute("INSERT INTO gacha_threads(thread_id, guild_id, user_id, parent_id) VALUES(?,?,?,?)",
+                 (thread_id, guild_id, user_id, parent_id))
+
+def _delete_thread(conn, thread_id):
+    conn.execute("DELETE FROM gacha_threads WHERE thread_id=?", (thread_id,))
+
+def _set_thread_archived(conn, thread_id, archived):
+    conn.execute("UPDATE gacha_threads SET archived=? WHERE thread_id=?", (int(archived), thread_id))
+
+# 以下2つは旧形式ジャーナルの再適用用（現在は全体付与をpoint_grantsに記録する）
+def _add_points_all(conn, amount, cap=POINT_CAP):
+    cursor = conn.execute("UPDATE user_points SET points=MIN(?, points + ?) WHERE MIN(?, points + ?) != points",
+                          (cap, amount, cap, amount))
+    return cursor.rowcount
+
+def _add_daily_points(conn, amount, cap=POINT_CAP):
+    conn.execute("UPDATE user_points SET points=MIN(?, points + ?) WHERE points < ?", (cap, amount, cap))
+
+# 書き込みキュー(writebehind)から名前で呼び出せる処理
+WRITE_OPS = {
+    "set_setting": _set_setting,
+    "set_points": _set_points,
+    "add_card": lambda conn, user_id, card_no: _add_cards(conn, user_id, [card_no]),
+    "add_cards": _add_cards,
+    "set_collection": _set_collection,
+    "add_grant": _add_grant,
+    "set_thread": _set_thread,
+    "delete_thread": _delete_thread,
+    "set_thread_archived": _set_thread_archived,
+    "add_points_all": _add_points_all,
+    "add_daily_points": _add_daily_points,
+}
+
+def apply_batch(ops, last_seq=None, seq_key="journal_seq"):
+    """
+    ops: [(op名, 引数リスト), ...] を1トランザクションで実行する
+    last_seq: 書き込みジャーナルの通し番号（同じトランザクションで seq_key に記録）
+    """
+    conn = get_connection()
+    with conn:
+        for op, args in ops:
+            WRITE_OPS[op](conn, *args)
+        if last_seq is not None:
+            _set_setting(conn, seq_key, last_seq)
+
+def set_setting(key: str, value):
+    conn = get_connection()
+    _set_setting(conn, key, value)
     conn.commit()
-    conn.close()
-    logger.info("Gacha data loaded into DB.")
 
-def get_points(user_id: int) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT points FROM user_points WHERE user_id=?", (user_id,))
-    row = cursor.fetchone()
+def _settled_points(conn, user_id, initial=INITIAL_POINTS, cap=POINT_CAP):
+    """未精算の全体付与を反映した (points, epoch)。未登録なら初期ポイント"""
+    current = conn.execute("SELECT COALESCE(MAX(epoch), 0) FROM point_grants").fetchone()[0]
+    row = conn.execute("SELECT points, epoch FROM user_points WHERE user_id=?", (user_id,)).fetchone()
     if not row:
-        # 初期10ポイント
-        conn.execute("INSERT INTO user_points(user_id, points) VALUES(?, ?)", (user_id, 10))
-        conn.commit()
-        conn.close()
-        return 10
-    conn.close()
-    return row[0]
-
-def set_points(user_id: int, points: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-    INSERT INTO user_points(user_id, points) VALUES(?,?)
-    ON CONFLICT(user_id) DO UPDATE SET points=excluded.points
-    """, (user_id, points))
+        return initial, current
+    points, epoch = row
+    for kind, amount in conn.execute("SELECT kind, amount FROM point_grants WHERE epoch > ? ORDER BY epoch", (epoch,)):
+        points = apply_grant(points, kind, amount, cap)
+    return points, current
+
+def _load_cards(conn, user_id):
+    row = conn.execute("SELECT bits FROM user_collections WHERE user_id=?", (user_id,)).fetchone()
+    cards = CardSet.from_bytes(row[0]) if row else CardSet()
+    for (card_no,) in conn.execute("SELECT card_no FROM user_cards WHERE user_id=?", (user_id,)):
+        cards.add(card_no)
+    return cards
+
+def get_points(user_id: int) -> int:
+    """未精算の全体付与を反映した残高を返す（未登録なら初期ポイントで登録）"""
+    conn = get_connection()
+    points, epoch = _settled_points(conn, user_id)
+    _set_points(conn, user_id, points, epoch)
+    conn.commit()
+    return points
+
+def set_points(user_id: int, points: int, epoch: int = 0):
+    conn = get_connection()
+    _set_points(conn, user_id, points, epoch)
     conn.commit()
-    conn.close()
 
 def add_card(user_id: int, card_no: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO user_cards (user_id, card_no) VALUES (?,?)", (user_id, card_no))
+    add_cards(user_id, [card_no])
+
+def add_cards(user_id: int, card_nos):
+    conn = get_connection()
+    _add_cards(conn, user_id, card_nos)
     conn.commit()
-    conn.close()
 
-def get_user_cards(user_id: int) -> list:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT card_no FROM user_cards WHERE user_id=?", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
+def set_collection(user_id: int, cards: CardSet):
+    conn = get_connection()
+    _set_collection(conn, user_id, cards.to_hex())
+    conn.commit()
 
-def add_daily_points():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, points FROM user_points")
-    rows = cursor.fetchall()
-    for user_id, pt in rows:
-        new_pt = pt if pt >= 10 else pt + 1
-        cursor.execute("UPDATE user_points SET points=? WHERE user_id=?", (new_pt, user_id))
+def get_user_cards(user_id: int) -> CardSet:
+    return _load_cards(get_connection(), user_id)
+
+# --- 複数プロセスで同じDBを使う時の処理 ---
+# BEGIN IMMEDIATE で書き込みロックを先に取り、読み込みから書き込みまでを他プロセスと直列にする
+
+def _immediate(conn, func, *args):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = func(conn, *args)
+    except BaseException:
+        conn.rollback()
+        raise
     conn.commit()
-    conn.close()
-    logger.info("Daily points added to all users.")
+    return result
 
-def get_random_item_from_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT no, url, chname, rarity, rate, title FROM gacha_items")
-    items = cursor.fetchall()
-    conn.close()
+def load_user(user_id: int):
+    """(points, epoch, CardSet)。未登録ならNone"""
+    conn = get_connection()
+    if conn.execute("SELECT 1 FROM user_points WHERE user_id=?", (user_id,)).fetchone() is None:
+        return None
+    points, epoch = _settled_points(conn, user_id)
+    return points, epoch, _load_cards(conn, user_id)
+
+def load_grants_since(epoch: int):
+    """epochより後の全体付与 [(kind, amount)]"""
+    return get_connection().execute(
+        "SELECT kind, amount FROM point_grants WHERE epoch > ? ORDER BY epoch", (epoch,)).fetchall()
+
+def _pull(conn, user_id, cost, card_nos, initial, cap):
+    points, epoch = _settled_points(conn, user_id, initial, cap)
+    cards = _load_cards(conn, user_id)
+    before = CardSet(cards.bits)
+    if points < cost:
+        _set_points(conn, user_id, points, epoch)
+        return False, points, epoch, before
+    for card_no in card_nos:
+        cards.add(card_no)
+    points -= cost
+    _set_points(conn, user_id, points, epoch)
+    if cards.bits != before.bits:
+        _set_collection(conn, user_id, cards.to_hex())
+    return True, points, epoch, before
+
+def pull(user_id: int, cost: int, card_nos, initial=INITIAL_POINTS, cap=POINT_CAP):
+    """
+    ポイント消費とカード追加を1トランザクションで行う
+    (成功したか, 残りポイント, epoch, 追加前のCardSet) を返す
+    """
+    conn = get_connection()
+    return _immediate(conn, _pull, user_id, cost, card_nos, initial, cap)
+
+def _add_user_points(conn, user_id, amount, cap):
+    old, epoch = _settled_points(conn, user_id, INITIAL_POINTS, cap)
+    new = min(cap, old + amount)
+    _set_points(conn, user_id, new, epoch)
+    return old, new, epoch
 
-    if not items:
+def add_user_points(user_id: int, amount: int, cap=POINT_CAP):
+    """個別付与（上限あり）。(旧ポイント, 新ポイント, epoch) を返す"""
+    return _immediate(get_connection(), _add_user_points, user_id, amount, cap)
+
+def _claim_daily_grant(conn, run_key, holder, default_amount):
+    cursor = conn.execute("INSERT OR IGNORE INTO job_runs(job, run_key, holder) VALUES(?,?,?)",
+                          ("daily_points", run_key, holder))
+    if cursor.rowcount == 0:
         return None
+    row = conn.execute("SELECT value FROM settings WHERE key='daily_auto_points'").fetchone()
+    amount = int(row[0]) if row else default_amount
+    return _next_grant(conn, GRANT_DAILY, amount), amount
+
+def claim_daily_grant(run_key: str, holder: str, default_amount: int):
+    """
+    run_key（日付）ごとに1回だけ毎日の付与を記録する
+    別のプロセスがすでに実行していればNone、実行したら (epoch, amount) を返す
+    """
+    return _immediate(get_connection(), _claim_daily_grant, run_key, holder, default_amount)
+
+def _next_grant(conn, kind, amount):
+    epoch = conn.execute("SELECT COALESCE(MAX(epoch), 0) + 1 FROM point_grants").fetchone()[0]
+    _add_grant(conn, epoch, kind, amount)
+    return epoch
+
+def add_grant(kind: str, amount: int) -> int:
+    """全体付与を履歴に1件追加する（ユーザー行は更新しない）。epochを返す"""
+    return _immediate(get_connection(), _next_grant, kind, amount)
+
+def add_points_all(amount: int) -> int:
+    return add_grant(GRANT_ADMIN, amount)
+
+def add_daily_points(amount: int) -> int:
+    epoch = add_grant(GRANT_DAILY, amount)
+    logger.info("Daily points added to all users.")
+    return epoch
+
+def get_random_item_from_db(rng=None):
+    global _item_cache
+    if _item_cache is None:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT no, url, chname, rarity, rate, title FROM gacha_items")
+        items = cursor.fetchall()
+
+        if not items:
+            return None
+        _item_cache = (items, AliasSampler([i[4] for i in items]))
 
-    total_rate = sum(i[4] for i in items)
-    import random
-    r = random.uniform(0, total_rate)
-    current = 0
-    for i in items:
-        current += i[4]
-        if r <= current:
-            return {
-                "no": i[0],
-                "url": i[1],
-                "chname": i[2],
-                "rarity": i[3],
-                "rate": i[4],
-                "title": i[5]
-            }
-    return None
+    items, sampler = _item_cache
+    i = items[sampler.draw(rng)]
+    return {
+        "no": i[0],
+        "url": i[1],
+        "chname": i[2],
+        "rarity": i[3],
+        "rate": i[4],
+        "title": i[5]
+    }
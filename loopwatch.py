@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+
+from botlog import log_event
+
+logger = logging.getLogger(__name__)
+
+# イベントループがこの時間(ms)以上止まったらスタックを記録する（0なら監視しない）
+WATCHDOG_THRESHOLD_MS = float(os.getenv("LOOP_WATCHDOG_THRESHOLD_MS", "0"))
+# 監視スレッドの確認間隔(ms)。未指定ならしきい値の1/4（最小10ms）
+WATCHDOG_INTERVAL_MS = float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", "0"))
+# asyncioのデバッグモード（遅いコールバックを asyncio ロガーに警告として出す）
+ASYNCIO_DEBUG = os.getenv("ASYNCIO_DEBUG", "") not in ("", "0")
+ASYNCIO_SLOW_CALLBACK_MS = float(os.getenv("ASYNCIO_SLOW_CALLBACK_MS", "100"))
+
+
+class WatchdogStats:
+    def __init__(self):
+        self.checks = 0
+        self.stalls = 0
+        self.max_blocked = 0.0
+
+    def as_dict(self):
+        return {
+            "checks": self.checks,
+            "stalls": self.stalls,
+            "max_blocked_ms": self.max_blocked * 1000,
+        }
+
+
+class LoopWatchdog:
+    """
+    イベントループの停止を別スレッドから検出する
+    監視スレッドが定期的にループへ応答確認(call_soon_threadsafe)を送り、
+    しきい値を過ぎても返ってこなければ、その時点のループのスレッドのスタック
+    （ループを止めているコルーチンの行）をログに出す。
+    """
+    def __init__(self, loop, threshold_ms=WATCHDOG_THRESHOLD_MS, interval_ms=WATCHDOG_INTERVAL_MS):
+        self.loop = loop
+        self.threshold = threshold_ms / 1000
+        self.interval = (interval_ms or max(10.0, threshold_ms / 4)) / 1000
+        self.stats = WatchdogStats()
+        self._loop_thread_id = None
+        self._sent = None       # 応答待ちの確認を送った時刻
+        self._reported = False  # 今回の停止をすでに記録したか
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """イベントループのスレッドから呼ぶ"""
+        self._loop_thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Loop watchdog started (threshold {self.threshold * 1000:.0f}ms)")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _pong(self):
+        # ループのスレッドで実行される
+        with self._lock:
+            sent, reported = self._sent, self._reported
+            self._sent = None
+            self._reported = False
+        if sent is None:
+            return
+        blocked = time.monotonic() - sent
+        self.stats.max_blocked = max(self.stats.max_blocked, blocked)
+        if reported:
+            logger.warning(f"Event loop resumed after {blocked * 1000:.0f}ms")
+            log_event("loop_stall", blocked_ms=round(blocked * 1000, 1))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            with self._lock:
+                if self._sent is None:
+                    self._sent = now
+                    send = True
+                else:
+                    send = False
+                    blocked = now - self._sent
+                    report = blocked >= self.threshold and not self._reported
+                    if report:
+                        self._reported = True
+            self.stats.checks += 1
+            if send:
+                try:
+                    self.loop.call_soon_threadsafe(self._pong)
+                except RuntimeError:
+                    # ループが閉じられた
+                    return
+            elif report:
+                self.stats.stalls += 1
+                self._report(blocked)
+
+    def _report(self, blocked):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_list(_task_frames(frame))) if frame is not None else "(no frame)\n"
+        logger.warning(f"Event loop blocked for {blocked * 1000:.0f}ms+; loop thread stack:\n{stack}")
+
+
+def _task_frames(frame):
+    """スタックからasyncio内部の呼び出しを除き、実行中のコールバック・コルーチン以降だけにする"""
+    frames = traceback.extract_stack(frame)
+    for i in range(len(frames) - 1, -1, -1):
+        if frames[i].filename.endswith(os.path.join("asyncio", "events.py")):
+            return frames[i + 1:]
+    return frames
+
+
+def configure_debug(loop, enabled=ASYNCIO_DEBUG, slow_callback_ms=ASYNCIO_SLOW_CALLBACK_MS):
+    """asyncioのデバッグモードを設定する（遅いコールバックを警告する）"""
+    if not enabled:
+        return
+    loop.set_debug(True)
+    loop.slow_callback_duration = slow_callback_ms / 1000
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+    logger.info(f"asyncio debug mode enabled (slow callback {slow_callback_ms:.0f}ms)")
+
+
+def install(loop=None, threshold_ms=WATCHDOG_THRESHOLD_MS):
+    """
+    環境変数の設定に従ってデバッグモードと監視スレッドを有効にする
+    監視スレッドを起動した場合はLoopWatchdogを、無効ならNoneを返す
+    """
+    loop = loop or asyncio.get_running_loop()
+    configure_debug(loop)
+    if threshold_ms <= 0:
+        return None
+    watchdog = LoopWatchdog(loop, threshold_ms)
+    watchdog.start()
+    return watchdog
@@ -1,55 +1,218 @@
 import os
-import sys
+import json
+import asyncio
+import hashlib
 import logging
 import discord
-from discord.ext import commands
 import pytz
 from datetime import datetime
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from catalog import CatalogStore
+import db
+from writebehind import WriteBehindQueue
+from points import PointLedger, GRANT_DAILY
+from render import RevealScheduler
+from txn import PullEngine
+from threads import ThreadRegistry
+from progress import CollectionStats
+from banners import BannerBoard
+import botlog
+from botlog import log_event
+import metrics
+import loopwatch
+import cluster
 
-# ログ設定
+# ログ設定（書き込みは別スレッド。ガチャ・コマンドはevents.jsonlにJSONで記録）
+botlog.setup_logging()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-file_handler = logging.FileHandler('bot.log', encoding='utf-8')
-formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-
-stream_handler = logging.StreamHandler(sys.stdout)
-stream_handler.setFormatter(formatter)
-logger.addHandler(stream_handler)
 
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix='/', intents=intents)
+# Discord APIの呼び出し回数・429・所要時間をmetricsに記録する
+# SHARD_COUNT / SHARD_IDS を指定するとAutoShardedBotになる（cluster.py参照）
+bot = cluster.create_bot(command_prefix='/', intents=intents, http_trace=metrics.http_trace())
+# 複数プロセスで同じDBを共有するか（Trueならポイント・カードの変更はDBのトランザクションで行う）
+bot.shared_state = cluster.SHARED_STATE
 
 # CSVデータのパス
 bot.gacha_data_path = 'data/gacha_data.csv'
+# ガチャデータは起動時に一度だけ読み込み、全コマンドで共有する
+bot.catalog = CatalogStore(bot.gacha_data_path)
 
 # タイムゾーンはJST
 JST = pytz.timezone('Asia/Tokyo')
 scheduler = AsyncIOScheduler(timezone=JST)
 
-# ユーザーデータ
-bot.user_points = {}      # {user_id: int} ユーザーポイント
-bot.user_cards = {}       # {user_id: [card_no, ...]} ユーザーが取得したカード
+# ユーザーデータ（起動時にDBから読み込み、変更はDBにも書き込む）
+bot.points = PointLedger(db.INITIAL_POINTS, db.POINT_CAP)  # ユーザーポイント（全体付与は読み出し時に精算）
+bot.user_cards = {}       # {user_id: CardSet} ユーザーが取得したカード
 bot.daily_auto_points = 3 # 毎日00:00に自動付与されるポイント数(初期値1)
-bot.last_gacha_usage = {} # クールダウン管理用
+bot.threads = ThreadRegistry()  # ユーザー専用ガチャスレッドの対応表
+bot.progress = CollectionStats()  # 図鑑の達成状況とランキング（カード入手時に更新）
+# ポイント・カードの変更はまとめてDBへ書き込む
+bot.writer = WriteBehindQueue(name=cluster.instance_name())
+# ガチャ演出の送信ペース管理
+bot.renderer = RevealScheduler()
+# ガチャ1回分の処理をユーザー単位で不可分に実行する
+bot.pulls = PullEngine(bot)
+# 期間限定ガチャ（data/banners.json）。開始・終了時刻にスケジューラーで開催中の表を差し替える
+bot.banners = BannerBoard(JST)
+
+# 各コンポーネントの統計を /metrics と /stats に出す
+metrics.REGISTRY.add_stats("gacha_write_behind", lambda: bot.writer.stats.as_dict())
+metrics.REGISTRY.add_stats("gacha_pull_lock", lambda: bot.pulls.locks.stats.as_dict())
+metrics.REGISTRY.add_stats("gacha_render", lambda: dict(bot.renderer.stats))
+# イベントループの停止検出（LOOP_WATCHDOG_THRESHOLD_MS を設定した時だけ動く）
+bot.watchdog = None
+bot.sync_tasks = []  # 共有モードで他プロセスの変更（全体付与・所持カード）を取り込むタスク
+
+def save_points(user_id):
+    # ユーザーのポイントを書き込みキューに入れる（ack用のFutureを返す）
+    points, epoch = bot.points.record(user_id)
+    return bot.writer.submit("set_points", user_id, points, epoch)
+
+bot.save_points = save_points
 
 def ensure_user_points(user_id):
     # ユーザーが未登録の場合、初期値15ptで登録
-    if user_id not in bot.user_points:
-        bot.user_points[user_id] = 15
+    # （共有モードでは、DBの行はポイント消費・付与のトランザクションで作られる）
+    if bot.points.ensure(user_id) and not bot.shared_state:
+        save_points(user_id)
 
 bot.ensure_user_points = ensure_user_points
 
-def add_daily_points():
+def register_thread(guild_id, user_id, thread_id, parent_id=None):
+    # ガチャスレッドを登録して保存する
+    bot.threads.register(guild_id, user_id, thread_id)
+    return bot.writer.submit("set_thread", guild_id, user_id, thread_id, parent_id)
+
+bot.register_thread = register_thread
+
+def unregister_thread(thread_id):
+    if bot.threads.unregister(thread_id) is not None:
+        bot.writer.submit("delete_thread", thread_id)
+
+bot.unregister_thread = unregister_thread
+
+async def refresh_user(user_id):
+    # 共有モードでは、他のプロセスの変更を反映するためにDBからユーザーを読み直す
+    if not bot.shared_state:
+        return
+    row = await db.run(db.load_user, user_id)
+    if row is not None:
+        points, epoch, cards = row
+        bot.points.store(user_id, points, epoch)
+        bot.user_cards[user_id] = cards
+        bot.progress.set_user(user_id, cards)
+
+bot.refresh_user = refresh_user
+
+async def sync_grants():
+    # 他のプロセスが記録した全体付与を取り込む
+    grants = await db.run(db.load_grants_since, bot.points.epoch)
+    if grants:
+        bot.points.extend_grants(grants)
+        logger.info(f"Synced {len(grants)} grant(s) from the shared database")
+
+bot.sync_grants = sync_grants
+
+async def sync_progress():
+    # 他のプロセスで引いたカードも図鑑・ランキングに反映する（DBの所持カードから作り直す）
+    catalog = bot.catalog.current
+    if catalog is None:
+        return
+    cards = await db.run(db.load_collections)
+    progress = CollectionStats()
+    await asyncio.to_thread(progress.rebuild, catalog, cards)
+    if bot.catalog.current is not catalog:
+        return  # 作り直している間にカタログが更新された（rebuild_progress が作り直し済み）
+    bot.user_cards.update(cards)
+    bot.progress = progress
+
+bot.sync_progress = sync_progress
+
+async def import_catalog(catalog):
+    # gacha_items をCSVの内容に合わせる（変更のあった行だけ）
+    await db.run(db.import_catalog, catalog)
+
+async def rebuild_progress(catalog):
+    # カード構成が変わったので達成状況を作り直す
+    bot.progress.rebuild(catalog, bot.user_cards)
+
+async def compile_banners(catalog):
+    # カード構成が変わったので全バナーの抽選テーブルを作り直す
+    await asyncio.to_thread(bot.banners.compile, catalog)
+    bot.banners.refresh()
+
+async def refresh_banners():
+    # バナーの開始・終了時刻に呼ばれる（作成済みの表を差し替えるだけ）
+    bot.banners.refresh()
+
+def schedule_banners():
+    # これから来る開始・終了時刻ごとに差し替えジョブを登録し直す
+    for job in scheduler.get_jobs():
+        if job.id.startswith("banner:"):
+            job.remove()
+    for run_date in bot.banners.boundaries():
+        scheduler.add_job(refresh_banners, 'date', run_date=run_date, id=f"banner:{run_date.isoformat()}",
+                          misfire_grace_time=None)
+
+async def reload_banners():
+    await asyncio.to_thread(bot.banners.load)
+    await compile_banners(bot.catalog.current)
+    schedule_banners()
+
+bot.reload_banners = reload_banners
+
+async def sync_loop(interval, sync, name):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await sync()
+        except Exception:
+            logger.exception(f"{name}の同期に失敗しました:")
+
+async def load_state():
+    # DBの初期化と保存済みユーザーデータの読み込み
+    await db.run(db.init_db)
+    await db.run(bot.writer.recover)
+    balances, bot.user_cards, grants = await db.run(db.load_state)
+    bot.points.load(balances, grants)
+    bot.threads.load(await db.run(db.load_threads))
+    daily = await db.run(db.get_setting, "daily_auto_points")
+    if daily is not None:
+        bot.daily_auto_points = int(daily)
+    bot.writer.start()
+
+_bot_close = bot.close
+
+async def close():
+    # 終了前に未書き込みの変更をDBへ反映する
+    bot.catalog.stop()
+    for task in bot.sync_tasks:
+        task.cancel()
+    await bot.writer.close()
+    if bot.watchdog is not None:
+        bot.watchdog.stop()
+    await _bot_close()
+
+bot.close = close
+
+async def add_daily_points():
     # 毎日00:00に全ユーザーに bot.daily_auto_points 分ポイント付与（最大15ptまで）
-    for user_id, points in bot.user_points.items():
-        if points < 15:
-            new_points = min(15, points + bot.daily_auto_points)
-            bot.user_points[user_id] = new_points
+    # 付与履歴に1件追加するだけで、各ユーザーへの反映は残高を読む時に行う
+    if bot.shared_state:
+        # 全プロセスで同時に動くので、日付ごとに最初に記録できた1プロセスだけが付与する
+        run_key = datetime.now(JST).strftime("%Y-%m-%d")
+        claimed = await db.run(db.claim_daily_grant, run_key, cluster.instance_name(), bot.daily_auto_points)
+        await sync_grants()
+        if claimed is None:
+            logger.info(f"Daily points for {run_key} were granted by another process")
+        else:
+            logger.info(f"Daily {claimed[1]} point(s) added to all users at JST 00:00")
+        return
+    epoch = bot.points.grant_all(bot.daily_auto_points, GRANT_DAILY)
+    await bot.writer.submit("add_grant", epoch, GRANT_DAILY, bot.daily_auto_points)
     logger.info(f"Daily {bot.daily_auto_points} point(s) added to all users at JST 00:00")
 
 scheduler.add_job(add_daily_points, 'cron', hour=0, minute=0)
@@ -58,39 +221,115 @@ scheduler.add_job(add_daily_points, 'cron', hour=0, minute=0)
 @bot.event
 async def on_interaction(interaction: discord.Interaction):
     if interaction.type == discord.InteractionType.application_command:
-        command_name = interaction.data.get("name", "Unknown")
-        user = interaction.user
-        options = interaction.data.get("options", [])
-        param_list = []
-        for opt in options:
-            if "resolved" in opt:
-                resolved = opt["resolved"]
-                param_value = None
-                if isinstance(resolved, dict):
-                    if "username" in resolved and "discriminator" in resolved:
-                        param_value = f"{resolved['username']}#{resolved['discriminator']}"
-                    else:
-                        param_value = opt.get("value")
-                else:
-                    param_value = opt.get("value")
-            else:
-                param_value = opt.get("value")
-            param_list.append(f"{opt['name']}={param_value}")
-        params_str = ", ".join(param_list) if param_list else "None"
-        logger.info(f"User {user.name} (ID: {user.id}) used command /{command_name} with parameters: {params_str}")
+        # 整形は書き込みスレッド側で行うので、ここでは値を渡すだけ
+        log_event(
+            "command",
+            sample=botlog.COMMAND_LOG_SAMPLE,
+            command=interaction.data.get("name", "Unknown"),
+            user=interaction.user.name,
+            user_id=interaction.user.id,
+            guild_id=interaction.guild_id,
+            params={opt["name"]: opt.get("value") for opt in interaction.data.get("options", [])},
+            # Discordでの作成から受信までの時間
+            latency_ms=round((discord.utils.utcnow() - interaction.created_at).total_seconds() * 1000, 1),
+        )
 
+# ガチャスレッドの削除・アーカイブを対応表に反映する
 @bot.event
-async def on_ready():
-    logger.info(f'Logged in as {bot.user}!')
+async def on_raw_thread_delete(payload: discord.RawThreadDeleteEvent):
+    unregister_thread(payload.thread_id)
+
+@bot.event
+async def on_thread_update(before: discord.Thread, after: discord.Thread):
+    if before.archived != after.archived and bot.threads.set_archived(after.id, after.archived):
+        bot.writer.submit("set_thread_archived", after.id, after.archived)
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    # コマンド完了までの時間
+    latency = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    metrics.INTERACTION_SECONDS.observe(latency, command.qualified_name, "total")
+    log_event(
+        "command_done",
+        sample=botlog.COMMAND_LOG_SAMPLE,
+        command=command.qualified_name,
+        user_id=interaction.user.id,
+        latency_ms=round(latency * 1000, 1),
+    )
+
+COMMAND_HASH_KEY = "command_tree_hash"
+# 1ならコマンド定義が変わっていなくても同期する
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "") not in ("", "0")
+
+def command_tree_hash():
+    # アプリケーションコマンドの定義（名前・説明・引数など）のハッシュ
+    payload = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands()),
+                     key=lambda c: (c.get("type", 1), c["name"]))
+    data = json.dumps({"application_id": bot.application_id, "commands": payload},
+                      sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+async def sync_commands():
+    # 前回の同期からコマンド定義が変わった時だけDiscordへ同期する
+    digest = command_tree_hash()
+    if not FORCE_COMMAND_SYNC and await db.run(db.get_setting, COMMAND_HASH_KEY) == digest:
+        logger.info("Command tree unchanged; skipping sync.")
+        return
+    synced = await bot.tree.sync()
+    await bot.writer.submit("set_setting", COMMAND_HASH_KEY, digest)
+    logger.info(f"Synced {len(synced)} application command(s).")
+
+async def start_state():
+    # カタログとユーザーデータを読み込んでガチャを引ける状態にする（Discordには接続しない）
+    # ガチャデータの読み込みと抽選テーブル・一覧ページの作成は別スレッドで行う
+    await asyncio.to_thread(bot.catalog.load)
+    bot.catalog.start()
+    await load_state()
+    # CSVがない・不正な場合はガチャデータなしで起動する（各コマンドは「データが見つかりません」を返し、
+    # ファイルが直って再読み込みされた時に下の登録済みの処理が呼ばれる）
+    if bot.catalog.current is not None:
+        await import_catalog(bot.catalog.current)
+        await rebuild_progress(bot.catalog.current)
+    bot.catalog.subscribe(import_catalog)
+    bot.catalog.subscribe(rebuild_progress)
+    await reload_banners()
+    bot.catalog.subscribe(compile_banners)
+    if bot.shared_state:
+        loop = asyncio.get_running_loop()
+        bot.sync_tasks = [
+            loop.create_task(sync_loop(cluster.STATE_SYNC_INTERVAL, sync_grants, "全体付与")),
+            loop.create_task(sync_loop(cluster.PROGRESS_SYNC_INTERVAL, sync_progress, "図鑑・ランキング")),
+        ]
+
+async def setup_hook():
+    # ログイン後・Gateway接続前に1回だけ実行される（再接続では実行されない）
+    await start_state()
+    await metrics.start_http_server()
+    asyncio.get_running_loop().create_task(metrics.monitor_loop_lag())
+    bot.watchdog = loopwatch.install()
+    if bot.watchdog is not None:
+        metrics.REGISTRY.add_stats("gacha_loop_watchdog", bot.watchdog.stats.as_dict)
     # Cogの読み込み
     await bot.load_extension("cogs.gacha")
     await bot.load_extension("cogs.admin")
-    await bot.tree.sync()
+    await sync_commands()
     scheduler.start()
     logger.info("Scheduler started.")
 
-TOKEN = os.getenv('DISCORD_TOKEN')
-if TOKEN is None:
-    raise ValueError("DISCORD_TOKEN environment variable not set")
+bot.setup_hook = setup_hook
+
+@bot.event
+async def on_ready():
+    # 再接続のたびに呼ばれるので、ここでは初期化を行わない
+    logger.info(f'Logged in as {bot.user}!')
+
+def run():
+    token = os.getenv('DISCORD_TOKEN')
+    if token is None:
+        raise ValueError("DISCORD_TOKEN environment variable not set")
+    # ログはbotlogの設定だけで出す（discord.py独自のハンドラーを付けると二重に出力される）
+    bot.run(token, log_handler=None)
 
-bot.run(TOKEN)
+# import しただけでは起動しない（bench/run.py は bot と start_state をそのまま使う）
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,238 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Prometheus形式で公開するポート（0なら公開しない。ローカルのみで待ち受ける）
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+LOOP_LAG_INTERVAL = 0.5  # イベントループ遅延の計測間隔(秒)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = defaultdict(float)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] += amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {value}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, *label_values):
+        self.values[label_values] = value
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label値 -> [各バケットの件数..., +Inf], 合計, 件数
+        self._counts = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self._sums = defaultdict(float)
+
+    def observe(self, value, *label_values):
+        self._counts[label_values][bisect_left(self.buckets, value)] += 1
+        self._sums[label_values] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def count(self, *label_values):
+        return sum(self._counts.get(label_values, ()))
+
+    def keys(self):
+        return sorted(self._counts)
+
+    def quantile(self, q, *label_values):
+        """バケットから求めた分位点の概算（バケットの上限値を返す）"""
+        counts = self._counts.get(label_values)
+        if not counts:
+            return None
+        target = q * sum(counts)
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key in sorted(self._counts):
+            counts = self._counts[key]
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {self._sums[key]}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.stats_sources = {}  # 名前 -> dictを返す関数（書き込みキュー等の統計）
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_stats(self, prefix, func):
+        """dictを返す関数をゲージとして公開する（値は取得時に読む）"""
+        self.stats_sources[prefix] = func
+
+    def render(self):
+        """Prometheusのテキスト形式"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        for prefix, func in self.stats_sources.items():
+            for key, value in func().items():
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+INTERACTION_SECONDS = REGISTRY.register(Histogram(
+    "gacha_interaction_seconds", "Latency of slash commands and buttons by phase", ("name", "phase")))
+DISCORD_REQUESTS = REGISTRY.register(Counter(
+    "discord_api_requests_total", "Discord HTTP API calls", ("method", "route", "status")))
+DISCORD_RATELIMITED = REGISTRY.register(Counter(
+    "discord_api_ratelimited_total", "Discord HTTP API responses with status 429", ("route",)))
+DISCORD_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "discord_api_request_seconds", "Discord HTTP API call latency", ("method",)))
+DRAWS = REGISTRY.register(Counter(
+    "gacha_draws_total", "Cards drawn by rarity", ("rarity",)))
+CATALOG_RELOAD_SECONDS = REGISTRY.register(Histogram(
+    "catalog_reload_seconds", "Time to read and parse the gacha catalog"))
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "event_loop_lag_seconds", "How late the event loop woke up a sleeping task",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)))
+
+
+# Discord APIのURLからIDやトークンを除いてルート名にする
+_ID_RE = re.compile(r"/[0-9]{5,}")
+_TOKEN_RE = re.compile(r"(/webhooks/\{id\}|/interactions/\{id\})/[^/]+")
+
+
+def route_of(path):
+    path = _ID_RE.sub("/{id}", path)
+    return _TOKEN_RE.sub(r"\1/{token}", path)
+
+
+def http_trace():
+    """discord.pyのHTTP呼び出しを数えるaiohttpのTraceConfig（Botのhttp_traceに渡す）"""
+    import aiohttp
+
+    async def on_request_start(session, ctx, params):
+        ctx.started = time.perf_counter()
+
+    async def on_request_end(session, ctx, params):
+        route = route_of(params.url.path)
+        status = params.response.status
+        DISCORD_REQUESTS.inc(params.method, route, str(status))
+        DISCORD_REQUEST_SECONDS.observe(time.perf_counter() - ctx.started, params.method)
+        if status == 429:
+            DISCORD_RATELIMITED.inc(route)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """一定間隔で眠り、予定より遅れて起きた時間をイベントループの遅延として記録する"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - expected))
+
+
+async def start_http_server(host=METRICS_HOST, port=METRICS_PORT):
+    """/metrics を公開する（port=0なら何もしない）"""
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics server listening on http://{host}:{port}/metrics")
+    return runner
+
+
+def _ms(value):
+    return "-" if value is None else ("inf" if value == float("inf") else f"{value * 1000:.0f}ms")
+
+
+def summary_lines():
+    """/stats 用の要約"""
+    lines = ["[latency p50/p99 (count)]"]
+    for name, phase in INTERACTION_SECONDS.keys():
+        lines.append(f"{name}.{phase}: {_ms(INTERACTION_SECONDS.quantile(0.5, name, phase))}"
+                     f"/{_ms(INTERACTION_SECONDS.quantile(0.99, name, phase))}"
+                     f" ({INTERACTION_SECONDS.count(name, phase)})")
+    lines.append("[discord api]")
+    lines.append(f"calls: {DISCORD_REQUESTS.total():.0f}, 429: {DISCORD_RATELIMITED.total():.0f}")
+    lines.append("[draws]")
+    lines.append(", ".join(f"{rarity}={count:.0f}" for (rarity,), count in sorted(DRAWS.values.items())) or "-")
+    lines.append("[event loop lag p50/p99]")
+    lines.append(f"{_ms(LOOP_LAG_SECONDS.quantile(0.5))}/{_ms(LOOP_LAG_SECONDS.quantile(0.99))}")
+    lines.append("[catalog reload p50 (count)]")
+    lines.append(f"{_ms(CATALOG_RELOAD_SECONDS.quantile(0.5))} ({CATALOG_RELOAD_SECONDS.count()})")
+    for prefix, func in REGISTRY.stats_sources.items():
+        lines.append(f"[{prefix}]")
+        lines.append(", ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in func().items()))
+    return lines
@@ -0,0 +1,59 @@
+class CardSet:
+    """
+    ユーザーの所持カードを表すビットセット
+    カードNo.をそのままビット位置として使う（No.1 → 1ビット目）
+    """
+    __slots__ = ("bits",)
+
+    def __init__(self, bits=0):
+        self.bits = bits
+
+    @classmethod
+    def from_cards(cls, card_nos):
+        bits = 0
+        for card_no in card_nos:
+            bits |= 1 << int(card_no)
+        return cls(bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(int.from_bytes(data, 'little'))
+
+    @classmethod
+    def from_hex(cls, text):
+        return cls.from_bytes(bytes.fromhex(text))
+
+    def to_bytes(self):
+        """DB保存用（BLOB）"""
+        return self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')
+
+    def to_hex(self):
+        return self.to_bytes().hex()
+
+    def __contains__(self, card_no):
+        return (self.bits >> int(card_no)) & 1 == 1
+
+    def add(self, card_no):
+        """カードを追加する。新規ならTrueを返す"""
+        bit = 1 << int(card_no)
+        if self.bits & bit:
+            return False
+        self.bits |= bit
+        return True
+
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def __iter__(self):
+        bits = self.bits
+        while bits:
+            low = bits & -bits
+            yield str(low.bit_length() - 1)
+            bits ^= low
+
+    def count_in(self, mask):
+        """mask（カタログ等のビット集合）に含まれる所持数"""
+        return (self.bits & mask).bit_count()
+
+    def __repr__(self):
+        return f"CardSet({len(self)} cards)"
@@ -0,0 +1,64 @@
+from collections import defaultdict
+
+PER_PAGE = 20  # No.順リストの1ページあたりの件数
+
+OWNED_MARK = ":ballot_box_with_check:"
+UNOWNED_MARK = ":blue_square:"
+
+
+class PageSet:
+    """
+    一覧表示のページ群（カタログのバージョンごとに1回だけ作り、全ユーザーで共有する）
+    各行は「取得済み」「未取得」の2種類の文字列を事前に作っておき、
+    表示時はユーザーの所持ビットを見て選ぶだけにする。
+    """
+    def __init__(self, pages, labels):
+        # pages: [[(ビット位置, 取得済みの行, 未取得の行), ...], ...]
+        # labels: ページごとの見出し（chname順ならキャラ名、No.順ならNone）
+        self.pages = pages
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.pages)
+
+    def label(self, page):
+        return self.labels[page]
+
+    def render(self, page, cards):
+        """ページの本文を作る。cards: ユーザーのCardSet"""
+        bits = cards.bits
+        return "\n".join(owned if (bits >> bit) & 1 else unowned
+                         for bit, owned, unowned in self.pages[page])
+
+
+def card_line(item, owned, with_chname=True):
+    """一覧の1行。取得済みならリンク付き"""
+    name = f"{item['chname']} {item['title']}" if with_chname else item["title"]
+    if owned:
+        return f"{OWNED_MARK} **No.{item['no']}** {name} [🔗 Link]({item['url']})"
+    return f"{UNOWNED_MARK} **No.{item['no']}** {name}"
+
+
+def build_number_pages(items, per_page=PER_PAGE):
+    """No.順のページを作る"""
+    rows = []
+    # No.は読み込み時に整数か確認済み（catalog.parse_catalog）
+    for item in sorted(items, key=lambda item: int(item["no"])):
+        # 取得済み：アイコン + カード番号 + chname + タイトル + [🔗 Link]({url})
+        # 未取得：アイコン + カード番号 + chname + タイトル
+        rows.append((int(item["no"]), card_line(item, True), card_line(item, False)))
+    pages = [rows[i:i + per_page] for i in range(0, len(rows), per_page)]
+    return PageSet(pages, [None] * len(pages))
+
+
+def build_chname_pages(items):
+    """キャラ名(chname)ごとのページを作る（1キャラ = 1ページ、chname順）"""
+    grouped = defaultdict(list)
+    for item in items:
+        grouped[item["chname"]].append((
+            int(item["no"]),
+            card_line(item, True, with_chname=False),
+            card_line(item, False, with_chname=False),
+        ))
+    labels = sorted(grouped)
+    return PageSet([grouped[ch] for ch in labels], labels)
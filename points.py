@@ -0,0 +1,93 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+GRANT_DAILY = "daily"  # 毎日00:00の自動付与（上限以上のユーザーには付与しない）
+GRANT_ADMIN = "admin"  # 管理者による全体付与
+
+
+def apply_grant(points, kind, amount, cap):
+    """全体付与1件を残高に反映する"""
+    if kind == GRANT_DAILY:
+        if points < cap:
+            points = min(cap, points + amount)
+    else:
+        points = min(cap, points + amount)
+    return points
+
+
+class PointLedger:
+    """
+    ユーザーポイントの台帳
+    全体付与は「付与履歴」に1件追加するだけにして、各ユーザーへの反映は
+    そのユーザーの残高を読む時に行う（最後に精算した付与番号=epochから先だけを適用）。
+    """
+    def __init__(self, initial_points=15, cap=15):
+        self.initial_points = initial_points
+        self.cap = cap
+        self.grants = []     # [(kind, amount)] 添字+1 が epoch
+        self._balances = {}  # {user_id: (points, epoch)}
+
+    @property
+    def epoch(self):
+        return len(self.grants)
+
+    def load(self, balances, grants):
+        """DBから読み込んだ状態を設定する"""
+        self._balances = dict(balances)
+        self.grants = list(grants)
+
+    def __contains__(self, user_id):
+        return user_id in self._balances
+
+    def __len__(self):
+        return len(self._balances)
+
+    def _settle(self, user_id):
+        points, epoch = self._balances[user_id]
+        current = len(self.grants)
+        if epoch >= current:
+            return points
+        for kind, amount in self.grants[epoch:current]:
+            points = apply_grant(points, kind, amount, self.cap)
+        self._balances[user_id] = (points, current)
+        return points
+
+    def ensure(self, user_id):
+        """未登録なら初期ポイントで登録する。新規登録ならTrueを返す"""
+        if user_id in self._balances:
+            return False
+        self._balances[user_id] = (self.initial_points, len(self.grants))
+        return True
+
+    def get(self, user_id):
+        """未精算の付与を反映した残高を返す"""
+        return self._settle(user_id)
+
+    def set(self, user_id, points):
+        self._balances[user_id] = (points, len(self.grants))
+
+    def store(self, user_id, points, epoch):
+        """別プロセスが精算した (points, epoch) をそのまま反映する"""
+        self._balances[user_id] = (points, epoch)
+
+    def record(self, user_id):
+        """DB保存用の (points, epoch) を返す"""
+        return self._balances[user_id]
+
+    def add(self, user_id, amount):
+        """個別付与（上限あり）。(旧ポイント, 新ポイント) を返す"""
+        old = self._settle(user_id)
+        new = min(self.cap, old + amount)
+        self.set(user_id, new)
+        return old, new
+
+    def grant_all(self, amount, kind=GRANT_ADMIN):
+        """全ユーザーへの付与。ユーザー数に関係なくO(1)。新しいepochを返す"""
+        self.grants.append((kind, amount))
+        return len(self.grants)
+
+    def extend_grants(self, grants):
+        """DBから読んだ、epochがこの台帳より後の付与履歴を追加する（複数プロセス時）"""
+        self.grants.extend(grants)
+        return len(self.grants)
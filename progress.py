@@ -0,0 +1,123 @@
+from collections import defaultdict
+
+GROUP_CHNAME = "chname"
+GROUP_RARITY = "rarity"
+
+
+def build_group_masks(items):
+    """{(種類, 名前): ビット集合} キャラ名ごと・レア度ごとのカード集合"""
+    masks = defaultdict(int)
+    for item in items:
+        bit = 1 << int(item["no"])
+        masks[(GROUP_CHNAME, item["chname"])] |= bit
+        masks[(GROUP_RARITY, item["rarity"])] |= bit
+    return dict(masks)
+
+
+class UserProgress:
+    __slots__ = ("owned", "total", "groups", "rank")
+
+    def __init__(self, owned, total, groups, rank):
+        self.owned = owned
+        self.total = total
+        self.groups = groups  # {(種類, 名前): (所持数, 枚数)}
+        self.rank = rank      # 同率を含む順位（未所持ならNone）
+
+
+class CollectionStats:
+    """
+    図鑑の達成状況と所持数ランキング
+    カードを入手した時に、そのユーザーの所持数とキャラ・レア度ごとの所持数だけを更新する。
+    ランキングは所持数ごとのバケット（所持数 -> 到達順のユーザー）で持つので、
+    上位K件や順位の計算はユーザー数ではなくカードの枚数にしか比例しない。
+    """
+    def __init__(self):
+        self.catalog_version = None
+        self._card_mask = 0
+        self._group_masks = {}
+        self._card_groups = {}              # カードNo.(int) -> [(種類, 名前), ...]
+        self.scores = {}                    # user_id -> 所持数（カタログ内）
+        self.groups = {}                    # user_id -> {(種類, 名前): 所持数}
+        self._buckets = defaultdict(dict)   # 所持数 -> {user_id: None}（到達順）
+
+    def __len__(self):
+        return len(self.scores)
+
+    def rebuild(self, catalog, user_cards):
+        """カタログと全ユーザーの所持カードから作り直す（起動時・カタログ更新時）"""
+        self.catalog_version = catalog.version
+        self._card_mask = catalog.card_mask
+        self._group_masks = catalog.group_masks
+        card_groups = defaultdict(list)
+        for key, mask in self._group_masks.items():
+            while mask:
+                low = mask & -mask
+                card_groups[low.bit_length() - 1].append(key)
+                mask ^= low
+        self._card_groups = dict(card_groups)
+        self.scores.clear()
+        self.groups.clear()
+        self._buckets.clear()
+        for user_id, cards in user_cards.items():
+            self.set_user(user_id, cards)
+
+    def _move(self, user_id, old, new):
+        if old is not None:
+            bucket = self._buckets[old]
+            bucket.pop(user_id, None)
+            if not bucket:
+                del self._buckets[old]
+        self._buckets[new][user_id] = None
+        self.scores[user_id] = new
+
+    def set_user(self, user_id, cards):
+        """ユーザーの所持カードから集計し直す（DBから読み直した時など）"""
+        counts = {key: cards.count_in(mask) for key, mask in self._group_masks.items()}
+        self.groups[user_id] = {key: n for key, n in counts.items() if n}
+        self._move(user_id, self.scores.get(user_id), cards.count_in(self._card_mask))
+
+    def add_cards(self, user_id, card_nos):
+        """新しく入手したカードを反映する（card_nosは所持していなかったカードのみ）"""
+        groups = self.groups.setdefault(user_id, {})
+        added = 0
+        for card_no in card_nos:
+            keys = self._card_groups.get(int(card_no))
+            if keys is None:
+                continue
+            added += 1
+            for key in keys:
+                groups[key] = groups.get(key, 0) + 1
+        old = self.scores.get(user_id)
+        if added or old is None:
+            self._move(user_id, old, (old or 0) + added)
+
+    def top(self, k):
+        """所持数の多い順に [(順位, user_id, 所持数)]（同数なら先に到達した人が上）"""
+        result = []
+        rank = 1
+        for score in sorted(self._buckets, reverse=True):
+            if score == 0:
+                break
+            bucket = self._buckets[score]
+            for user_id in bucket:
+                if len(result) == k:
+                    return result
+                result.append((rank, user_id, score))
+            rank += len(bucket)
+        return result
+
+    def rank(self, user_id):
+        """同率を含む順位（1 + 所持数が自分より多い人数）"""
+        score = self.scores.get(user_id)
+        if not score:
+            return None
+        return 1 + sum(len(bucket) for s, bucket in self._buckets.items() if s > score)
+
+    def progress(self, user_id):
+        groups = self.groups.get(user_id, {})
+        return UserProgress(
+            owned=self.scores.get(user_id, 0),
+            total=self._card_mask.bit_count(),
+            groups={key: (groups.get(key, 0), mask.bit_count()) for key, mask in self._group_masks.items()},
+            rank=self.rank(user_id),
+        )
@@ -0,0 +1,171 @@
+import math
+import time
+import heapq
+import asyncio
+import functools
+import itertools
+
+
+class TokenBucket:
+    """
+    トークンバケット
+    rate: 1秒あたりの補充数 / capacity: 最大トークン数
+    """
+    __slots__ = ("rate", "capacity", "_tokens", "_updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self):
+        self._refill()
+        return self._tokens
+
+    def try_take(self, n=1):
+        """トークンがあれば消費してTrueを返す"""
+        self._refill()
+        if self._tokens >= n:
+            self._tokens -= n
+            return True
+        return False
+
+    def delay_for(self, n=1):
+        """n個消費できるまでの待ち時間(秒)"""
+        self._refill()
+        if self._tokens >= n:
+            return 0.0
+        return (n - self._tokens) / self.rate
+
+    async def acquire(self, n=1):
+        """トークンがたまるまで待って消費する"""
+        while not self.try_take(n):
+            await asyncio.sleep(self.delay_for(n))
+
+
+class ExpiringDict:
+    """
+    有効期限つきのdict
+    期限切れのキーはヒープで管理し、アクセスのたびにまとめて削除するので
+    使われなくなったキーが残り続けない。
+    """
+    def __init__(self):
+        self._data = {}   # key -> (期限, 値)
+        self._heap = []   # (期限, 通し番号, key)
+        self._counter = itertools.count()
+
+    def purge(self, now=None):
+        """期限切れのキーを削除する"""
+        now = time.monotonic() if now is None else now
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires, _, key = heapq.heappop(heap)
+            entry = self._data.get(key)
+            # 期限が延長されていれば古いヒープ要素なので無視
+            if entry is not None and entry[0] <= now:
+                del self._data[key]
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value, ttl):
+        now = time.monotonic()
+        self.purge(now)
+        expires = now + ttl
+        self._data[key] = (expires, value)
+        heapq.heappush(self._heap, (expires, next(self._counter), key))
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        self.purge()
+        return len(self._data)
+
+
+class KeyedTokenBuckets:
+    """
+    キー（チャンネルID・ルート名・ユーザーIDなど）ごとのトークンバケット
+    満タンに戻るまで使われなかったバケットは新品と同じなので自動で削除する。
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.ttl = capacity / rate
+        self._buckets = ExpiringDict()
+
+    def get(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity)
+        # 使うたびに期限を延長
+        self._buckets.set(key, bucket, self.ttl)
+        return bucket
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimit:
+    """
+    インタラクション用の制限
+    key: インタラクションからキーを取り出す関数（ユーザーID・サーバーIDなど。Noneなら制限しない）
+    message: 制限中に返すメッセージ（{remain} に残り秒数が入る）
+    """
+    def __init__(self, rate, capacity, key, message):
+        self.buckets = KeyedTokenBuckets(rate, capacity)
+        self.key = key
+        self.message = message
+
+    @classmethod
+    def cooldown(cls, seconds, key, message):
+        """seconds秒に1回だけ許可する"""
+        return cls(1 / seconds, 1, key, message)
+
+    def hit(self, interaction):
+        """1回分を消費する。制限中なら残り秒数を返す（許可なら0）"""
+        key = self.key(interaction)
+        if key is None:
+            return 0.0
+        bucket = self.buckets.get(key)
+        if bucket.try_take():
+            return 0.0
+        return bucket.delay_for()
+
+
+def per_user(interaction):
+    return interaction.user.id
+
+
+def per_guild(interaction):
+    return interaction.guild_id
+
+
+def rate_limited(*limits):
+    """
+    スラッシュコマンド・UIボタンのコールバック用デコレーター
+    (self, interaction, ...) の形の関数に使える。制限中はエフェメラルで通知して終了する。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, interaction, *args, **kwargs):
+            for limit in limits:
+                retry_after = limit.hit(interaction)
+                if retry_after > 0:
+                    await interaction.response.send_message(
+                        limit.message.format(remain=math.ceil(retry_after)), ephemeral=True
+                    )
+                    return
+            return await func(self, interaction, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,125 @@
+import os
+import asyncio
+import logging
+
+import discord
+
+from ratelimit import KeyedTokenBuckets
+
+logger = logging.getLogger(__name__)
+
+# チャンネルごとの送信・編集の上限（Discordのチャンネル単位の制限より少し控えめに）
+CHANNEL_RATE = float(os.getenv("RENDER_CHANNEL_RATE", "1.0"))   # 1秒あたり
+CHANNEL_BURST = float(os.getenv("RENDER_CHANNEL_BURST", "5"))
+# インタラクションごとの上限（followupの送信・編集はインタラクションのトークン単位で制限される）
+INTERACTION_RATE = float(os.getenv("RENDER_INTERACTION_RATE", "2.5"))
+INTERACTION_BURST = float(os.getenv("RENDER_INTERACTION_BURST", "5"))
+
+# 結果表示で使うフィールド: キー -> (フィールド名, 値の作り方, inline)
+REVEAL_FIELDS = {
+    "chname": ("キャラ", lambda r: r["chname"], True),
+    "rarity": ("レア度", lambda r: r["rarity"], True),
+    "no": ("イラストNo.", lambda r: f"No.{r['no']}", True),
+    "new": ("\u200b", lambda r: "✨NEW✨" if r["is_new"] else None, True),
+    "title": ("タイトル", lambda r: r["title"], True),
+    "url": ("URL", lambda r: r["url"], False),
+    "points": ("残りポイント", lambda r: f"**{r['remaining_points']} pt**", False),
+}
+
+# ガチャ演出のフレーム定義（上から順に表示。delayは前のフレームからの秒数）
+#   placeholder: 最初に送るテキスト / fields: このフレームで追加するフィールド / image: 画像を表示
+REVEAL_FRAMES = (
+    {"delay": 0, "placeholder": "ガチャ中…"},
+    {"delay": 1, "fields": ()},
+    {"delay": 1, "fields": ("chname",)},
+    {"delay": 1, "fields": ("rarity", "no", "new", "title")},
+    {"delay": 1, "fields": ("url",), "image": True},
+    {"delay": 1, "fields": ("points",)},
+)
+
+
+def build_reveal_frames(result, embed_title, frames=REVEAL_FRAMES):
+    """
+    フレーム定義から送信内容を作る
+    result: chname, rarity, no, title, url, is_new, remaining_points を持つdict
+    戻り値: [(delay, message.editに渡す引数), ...] 先頭だけは送信用
+    """
+    embed = discord.Embed(title=embed_title)
+    built = []
+    for frame in frames:
+        if "placeholder" in frame:
+            built.append((frame["delay"], {"content": frame["placeholder"]}))
+            continue
+        for key in frame.get("fields", ()):
+            name, value_of, inline = REVEAL_FIELDS[key]
+            value = value_of(result)
+            if value is not None:
+                embed.add_field(name=name, value=value, inline=inline)
+        if frame.get("image"):
+            embed.set_image(url=result["url"])
+        built.append((frame["delay"], {"content": None, "embed": embed.copy()}))
+    return built
+
+
+class RevealScheduler:
+    """
+    ガチャ結果の演出をまとめて管理する
+    チャンネル・インタラクションごとのトークンバケットで送信ペースを抑え、
+    どちらかが混んでいる時は途中のフレームを間引くか、最終結果だけを1回で表示する。
+    混んでいる時にトークンを待つのは、必ず送る最初と最後の送信だけにする。
+    """
+    def __init__(self, channel_rate=CHANNEL_RATE, channel_burst=CHANNEL_BURST,
+                 interaction_rate=INTERACTION_RATE, interaction_burst=INTERACTION_BURST):
+        self.channels = KeyedTokenBuckets(channel_rate, channel_burst)
+        self.interactions = KeyedTokenBuckets(interaction_rate, interaction_burst)
+        self.stats = {"calls": 0, "reveals": 0, "fast_reveals": 0, "dropped_frames": 0}
+
+    def _buckets(self, interaction):
+        return (self.channels.get(interaction.channel_id), self.interactions.get(interaction.token))
+
+    async def _call(self, buckets, func, **kwargs):
+        for bucket in buckets:
+            await bucket.acquire()
+        self.stats["calls"] += 1
+        return await func(**kwargs)
+
+    @staticmethod
+    def _try_take(buckets, reserve=0):
+        """待たずに1回分を取る（どのバケットにも reserve 回分の余裕が残る時だけ）"""
+        if any(bucket.tokens < 1 + reserve for bucket in buckets):
+            return False
+        for bucket in buckets:
+            bucket.try_take()
+        return True
+
+    async def send(self, interaction, **kwargs):
+        """演出なしで1回送信する（レート制御のみ）"""
+        return await self._call(self._buckets(interaction), interaction.followup.send, **kwargs)
+
+    async def reveal(self, interaction, frames):
+        """build_reveal_framesで作ったフレームを順に表示する"""
+        buckets = self._buckets(interaction)
+        final = frames[-1][1]
+        self.stats["reveals"] += 1
+
+        # 最初と最後の2回分の余裕がなければ、最終結果だけを表示
+        if not self._try_take(buckets, reserve=1):
+            self.stats["fast_reveals"] += 1
+            self.stats["dropped_frames"] += len(frames) - 1
+            await self._call(buckets, interaction.followup.send, embed=final["embed"])
+            return
+
+        self.stats["calls"] += 1
+        message = await interaction.followup.send(**frames[0][1])
+        rest = frames[1:]
+        for i, (delay, kwargs) in enumerate(rest):
+            await asyncio.sleep(delay)
+            if i == len(rest) - 1:
+                await self._call(buckets, message.edit, **kwargs)
+                break
+            # 最終フレームの分を残せない時は途中のフレームを飛ばす（次のフレームにまとめて反映）
+            if not self._try_take(buckets, reserve=1):
+                self.stats["dropped_frames"] += 1
+                continue
+            self.stats["calls"] += 1
+            await message.edit(**kwargs)
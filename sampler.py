@@ -0,0 +1,105 @@
+import random
+
+
+class AliasSampler:
+    """
+    Walker/Vose のエイリアス法による重み付き抽選
+    テーブル作成はO(n)、1回の抽選はO(1)
+    """
+    def __init__(self, weights, rng=None):
+        weights = [float(w) for w in weights]
+        n = len(weights)
+        if n == 0:
+            raise ValueError("weights must not be empty")
+        total = sum(weights)
+        if total <= 0 or any(w < 0 for w in weights):
+            raise ValueError("weights must be non-negative and sum to a positive value")
+
+        self.n = n
+        self.total = total
+        self.rng = rng or random.Random()
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+        self._np_tables = None
+        self._np_rng = None
+
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # 丸め誤差で残ったものは確率1とする
+        for i in large + small:
+            self.prob[i] = 1.0
+
+    @classmethod
+    def from_tables(cls, prob, alias, total, rng=None):
+        """作成済みのテーブル（スナップショットのmemoryviewなど）から作る"""
+        self = cls.__new__(cls)
+        self.n = len(prob)
+        self.total = total
+        self.rng = rng or random.Random()
+        self.prob = prob
+        self.alias = alias
+        self._np_tables = None
+        self._np_rng = None
+        return self
+
+    def __len__(self):
+        return self.n
+
+    def seed(self, seed):
+        """乱数の種を固定する（ベンチマークなどで同じ抽選結果を再現する用）"""
+        import numpy as np
+        self.rng = random.Random(seed)
+        # まとめて引く側の種もここで決めておく（最初の10連がいつ来ても同じ列になるように）
+        self._np_rng = np.random.default_rng(self.rng.getrandbits(64))
+        return self
+
+    def draw(self, rng=None):
+        """インデックスを1つ抽選する"""
+        u = (rng or self.rng).random() * self.n
+        i = int(u)
+        if i == self.n:
+            i -= 1
+        return i if u - i < self.prob[i] else self.alias[i]
+
+    def _numpy_tables(self):
+        import numpy as np
+        if self._np_tables is None:
+            self._np_tables = (np.asarray(self.prob, dtype=np.float64),
+                               np.asarray(self.alias, dtype=np.intp))
+        return self._np_tables
+
+    def warm(self):
+        """NumPy用のテーブルを先に作る（初回の10連でnumpyのimportを待たないように）"""
+        self._numpy_tables()
+        return self
+
+    def draw_array(self, k, rng=None):
+        """
+        k回分の抽選をNumPyでまとめて行い、インデックスの配列(numpy.ndarray)を返す
+        rng: numpy.random.Generator（省略時はself.rngから種を取って作成）
+        """
+        import numpy as np
+        prob, alias = self._numpy_tables()
+        if rng is None:
+            if self._np_rng is None:
+                self._np_rng = np.random.default_rng(self.rng.getrandbits(64))
+            rng = self._np_rng
+        u = rng.random(k) * self.n
+        i = u.astype(np.intp)
+        np.minimum(i, self.n - 1, out=i)
+        return np.where(u - i < prob[i], i, alias[i])
+
+    def draw_many(self, k, rng=None):
+        """k回分の抽選をまとめて行い、インデックスのリストを返す"""
+        return self.draw_array(k, rng).tolist()
@@ -0,0 +1,81 @@
+import unicodedata
+from collections import defaultdict
+
+NGRAM = 2  # 転置インデックスのn（1文字の検索は1-gramで引く）
+SEARCH_FIELDS = ("title", "chname")
+
+# ひらがな → カタカナ（「ゆい」で「ユイ」も見つかるように）
+_HIRA_TO_KATA = {code: code + 0x60 for code in range(0x3041, 0x3097)}
+
+
+def normalize(text):
+    """全角・半角、大文字・小文字、ひらがな・カタカナの違いをなくす"""
+    return unicodedata.normalize("NFKC", text).casefold().translate(_HIRA_TO_KATA).strip()
+
+
+def _grams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class SearchIndex:
+    """
+    カードのタイトル・キャラ名の文字n-gram転置インデックス（カタログのバージョンごとに1回作る）
+    各n-gramの出現カードは所持カードと同じビット集合で持つので、
+    絞り込みも所持・未所持の判定もビット演算だけで済む。
+    """
+    def __init__(self, items):
+        self.by_bit = {}
+        self.texts = {}                  # ビット位置 -> 正規化した検索対象文字列
+        self.postings = defaultdict(int) # n-gram -> ビット集合
+        self.all = 0
+        for item in items:
+            bit = int(item["no"])
+            text = "\n".join(normalize(item[field]) for field in SEARCH_FIELDS)
+            self.by_bit[bit] = item
+            self.texts[bit] = text
+            self.all |= 1 << bit
+            for n in (1, NGRAM):
+                for gram in _grams(text, n):
+                    self.postings[gram] |= 1 << bit
+        self.postings = dict(self.postings)
+
+    def match(self, query):
+        """queryを含むカードのビット集合"""
+        query = normalize(query)
+        if not query:
+            return self.all
+        # No.での検索
+        number = 1 << int(query) if query.isdigit() and len(query) < 6 else 0
+        n = 1 if len(query) < NGRAM else NGRAM
+        mask = self.all
+        for gram in _grams(query, n):
+            mask &= self.postings.get(gram, 0)
+            if not mask:
+                break
+        if len(query) <= n:
+            return mask | (number & self.all)
+        # n-gramがすべて含まれていても並びが違う場合があるので、候補だけ文字列で確認する
+        result = 0
+        bits = mask
+        while bits:
+            low = bits & -bits
+            bit = low.bit_length() - 1
+            if query in self.texts[bit]:
+                result |= low
+            bits ^= low
+        return result | (number & self.all)
+
+    def search(self, query, include=None, exclude=0, limit=25):
+        """
+        No.順に最大limit件のカードを返す
+        include: このビット集合に含まれるものだけ（所持カードなど） / exclude: 含まれるものを除く
+        """
+        mask = self.match(query) & ~exclude
+        if include is not None:
+            mask &= include
+        results = []
+        while mask and len(results) < limit:
+            low = mask & -mask
+            results.append(self.by_bit[low.bit_length() - 1])
+            mask ^= low
+        return results
@@ -0,0 +1,300 @@
+"""
+排出率の検証とコンプリートまでの回数のシミュレーション（NumPy）
+
+    python simulate.py rates --pulls 10000000             # 抽選テーブルで引いてCSVの排出率と比較
+    python simulate.py rates --banner momo-pickup         # banners.json のバナーで比較
+    python simulate.py audit events.jsonl*                # 実際のガチャ記録(draw)と比較
+    python simulate.py complete --users 20000             # 全種コンプリートまでの回数・日数
+    python simulate.py complete --chname モモ --interval 3
+
+botと同じ CatalogStore（スナップショットがあれば使う）と banners.json から抽選テーブルを作り、
+AliasSampler.draw_array でまとめて引く。
+コンプリートの日数は「初日に初期ポイントを使い切り、その後は interval 日ごとに
+貯まったポイント（毎日の付与、上限 POINT_CAP）を使い切る」ユーザーとして数える。
+"""
+import os
+import sys
+import json
+import math
+import time
+import sqlite3
+import argparse
+from collections import Counter
+
+import numpy as np
+import pytz
+
+import db
+from catalog import CatalogStore
+from banners import BannerBoard, BANNERS_PATH
+
+JST = pytz.timezone('Asia/Tokyo')
+CSV_PATH = 'data/gacha_data.csv'
+RARITIES = ("N", "R", "SR", "SSR", "UR")
+DEFAULT_DAILY_POINTS = 3  # main.py の bot.daily_auto_points の初期値
+CHUNK = 1 << 20           # 1回にまとめて引く数
+USER_CHUNK = 50000        # コンプリートのシミュレーションで同時に扱うユーザー数
+PERCENTILES = (10, 50, 90, 99)
+
+
+def load_source(csv_path, banner_id=None, banners_path=BANNERS_PATH):
+    """抽選元（Catalog か Banner）を bot と同じ手順で作る"""
+    catalog = CatalogStore(csv_path).load()
+    if catalog is None:
+        raise SystemExit(f"cannot load the catalog: {csv_path}")
+    if banner_id is None:
+        return catalog
+    board = BannerBoard(JST, banners_path)
+    board.load()
+    board.compile(catalog)
+    banner = board.banner(banner_id)
+    if banner is None:
+        raise SystemExit(f"unknown banner: {banner_id} (defined: {', '.join(s.id for s in board.specs)})")
+    return banner
+
+
+def expected_rates(source):
+    """CSVの rate 列（バナーなら倍率をかけたもの）から求めた各カードの排出確率"""
+    spec = getattr(source, "spec", None)
+    weights = np.array([spec.weight(item) if spec else item["rate"] for item in source.items], dtype=np.float64)
+    return weights / weights.sum()
+
+
+def draw_counts(sampler, pulls, rng):
+    """pulls回引いて、カードごとの回数を返す"""
+    counts = np.zeros(len(sampler), dtype=np.int64)
+    done = 0
+    while done < pulls:
+        k = min(CHUNK, pulls - done)
+        counts += np.bincount(sampler.draw_array(k, rng), minlength=len(sampler))
+        done += k
+    return counts
+
+
+def chi2_pvalue(chi2, df):
+    """カイ二乗分布の上側確率（Wilson–Hilferty近似）"""
+    if df <= 0:
+        return 1.0
+    z = ((chi2 / df) ** (1 / 3) - (1 - 2 / (9 * df))) / math.sqrt(2 / (9 * df))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def deviation_rows(labels, counts, expected):
+    """[(ラベル, 回数, 期待%, 実測%, 差%, z)]"""
+    total = counts.sum()
+    observed = counts / total
+    sigma = np.sqrt(expected * (1 - expected) / total)
+    z = np.divide(observed - expected, sigma, out=np.zeros_like(sigma), where=sigma > 0)
+    return [(label, int(c), e * 100, o * 100, (o - e) * 100, zz)
+            for label, c, e, o, zz in zip(labels, counts, expected, observed, z)]
+
+
+def print_rows(title, rows):
+    print(title)
+    print(f"  {'':<28} {'count':>10} {'expected%':>10} {'observed%':>10} {'diff%':>9} {'z':>7}")
+    for label, count, exp, obs, diff, z in rows:
+        print(f"  {label:<28} {count:>10} {exp:>10.4f} {obs:>10.4f} {diff:>+9.4f} {z:>+7.2f}")
+
+
+def report(source, counts, top):
+    """レア度ごと・カードごとのずれを表示する。全体の適合度検定のp値を返す"""
+    items = source.items
+    expected = expected_rates(source)
+    total = int(counts.sum())
+    print(f"{total} pulls, {len(items)} cards")
+
+    rarities = [r for r in RARITIES if any(item["rarity"] == r for item in items)]
+    rarities += sorted({item["rarity"] for item in items} - set(rarities))
+    index = {r: i for i, r in enumerate(rarities)}
+    rarity_of = np.array([index[item["rarity"]] for item in items])
+    print_rows("by rarity:", deviation_rows(
+        rarities,
+        np.bincount(rarity_of, weights=counts, minlength=len(rarities)).astype(np.int64),
+        np.bincount(rarity_of, weights=expected, minlength=len(rarities))))
+
+    rows = deviation_rows([f"No.{item['no']} {item['rarity']} {item['chname']}" for item in items], counts, expected)
+    if top:
+        rows = sorted(rows, key=lambda row: abs(row[5]), reverse=True)[:top]
+        title = f"by card (top {len(rows)} by |z|):"
+    else:
+        title = "by card:"
+    print_rows(title, rows)
+
+    mask = expected > 0
+    chi2 = float((((counts - total * expected) ** 2)[mask] / (total * expected[mask])).sum())
+    p_value = chi2_pvalue(chi2, int(mask.sum()) - 1)
+    print(f"chi-square={chi2:.1f} df={int(mask.sum()) - 1} p={p_value:.4f}")
+    unexpected = int(counts[~mask].sum())
+    if unexpected:
+        print(f"WARNING: {unexpected} draw(s) of cards with rate 0")
+    return p_value
+
+
+def read_draws(paths, banner_id=None):
+    """events.jsonl から draw イベントのカードNo.を数える（バナー指定時はそのバナーのみ）"""
+    cards = Counter()
+    banners = Counter()
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get("event") != "draw":
+                    continue
+                banner = event.get("banner")
+                banners[banner] += 1
+                if banner_id is None or banner == banner_id:
+                    cards[str(event["card"])] += 1
+    return cards, banners
+
+
+def pulls_to_days(pulls, initial, per_session, interval):
+    """n回目を引けるのが何日目か（0日目に初期ポイント、その後は interval 日ごとに per_session 回）"""
+    extra = np.maximum(pulls - initial, 0)
+    return -(-extra // per_session) * interval
+
+
+def completion_pulls(sampler, targets, users, rng, max_pulls):
+    """
+    targets（カードの添字）を全部そろえるまでに引いた回数をユーザーごとに返す
+    max_pulls回でそろわなかったユーザーは -1
+    """
+    m = len(targets)
+    column = np.full(len(sampler), m, dtype=np.intp)  # 対象外のカードはダミーの列m
+    column[targets] = np.arange(m)
+    result = np.full(users, -1, dtype=np.int64)
+    for start in range(0, users, USER_CHUNK):
+        n = min(USER_CHUNK, users - start)
+        owned = np.zeros((n, m + 1), dtype=bool)
+        missing = np.full(n, m, dtype=np.int64)
+        active = np.arange(n)
+        for step in range(1, max_pulls + 1):
+            col = column[sampler.draw_array(len(active), rng)]
+            new = ~owned[active, col] & (col < m)
+            owned[active, col] = True
+            missing[active] -= new
+            done = missing[active] == 0
+            if done.any():
+                result[start + active[done]] = step
+                active = active[~done]
+                if not len(active):
+                    break
+    return result
+
+
+def default_daily_points():
+    """DBに保存された毎日の付与ポイント（/addpointauto）。なければ初期値"""
+    if os.path.exists(db.DB_PATH):
+        try:
+            value = db.get_setting("daily_auto_points")
+        except sqlite3.Error:
+            value = None
+        if value is not None:
+            return int(value)
+    return DEFAULT_DAILY_POINTS
+
+
+def cmd_rates(args, rng):
+    source = load_source(args.csv, args.banner, args.banners)
+    started = time.perf_counter()
+    counts = draw_counts(source.sampler, args.pulls, rng)
+    elapsed = time.perf_counter() - started
+    p_value = report(source, counts, args.top)
+    print(f"simulated in {elapsed:.2f}s ({args.pulls / elapsed / 1e6:.1f}M pulls/s)")
+    return 1 if p_value < args.alpha else 0
+
+
+def cmd_audit(args, rng):
+    source = load_source(args.csv, args.banner, args.banners)
+    cards, banners = read_draws(args.events, args.banner)
+    print("draw events by banner: " + ", ".join(f"{b or '(none)'}={n}" for b, n in banners.most_common()))
+    index = {item["no"]: i for i, item in enumerate(source.items)}
+    counts = np.zeros(len(source.items), dtype=np.int64)
+    unknown = 0
+    for card_no, n in cards.items():
+        if card_no in index:
+            counts[index[card_no]] += n
+        else:
+            unknown += n
+    if unknown:
+        print(f"WARNING: {unknown} draw(s) of cards not in this catalog/banner")
+    if not counts.sum():
+        print("no draw events to audit")
+        return 1
+    p_value = report(source, counts, args.top)
+    return 1 if p_value < args.alpha else 0
+
+
+def cmd_complete(args, rng):
+    source = load_source(args.csv, args.banner, args.banners)
+    chnames = set(args.chname or ())
+    rarities = set(args.rarity or ())
+    targets = np.array([i for i, item in enumerate(source.items)
+                        if (not chnames or item["chname"] in chnames) and (not rarities or item["rarity"] in rarities)],
+                       dtype=np.intp)
+    if not len(targets):
+        raise SystemExit("no cards match the target")
+    daily = default_daily_points() if args.daily is None else args.daily
+    per_session = min(db.POINT_CAP, daily * args.interval)
+    if per_session <= 0:
+        raise SystemExit("no points are granted, so the set can never be completed")
+
+    started = time.perf_counter()
+    pulls = completion_pulls(source.sampler, targets, args.users, rng, args.max_pulls)
+    elapsed = time.perf_counter() - started
+    done = pulls[pulls > 0]
+    days = pulls_to_days(done, db.INITIAL_POINTS, per_session, args.interval)
+
+    print(f"target: {len(targets)} cards, {args.users} users")
+    print(f"points: initial {db.INITIAL_POINTS}, +{daily}/day, cap {db.POINT_CAP}, "
+          f"pulling every {args.interval} day(s) ({per_session} pulls/session, "
+          f"{daily * args.interval - per_session} pt lost to the cap)")
+    if len(done):
+        print("  " + " ".join(f"{'p%d' % p:>8}" for p in PERCENTILES) + f" {'mean':>8}")
+        for label, values in (("pulls", done), ("days", days)):
+            cells = " ".join(f"{v:>8.0f}" for v in np.percentile(values, PERCENTILES))
+            print(f"  {cells} {values.mean():>8.1f}  {label}")
+    incomplete = args.users - len(done)
+    if incomplete:
+        print(f"{incomplete} user(s) did not complete within {args.max_pulls} pulls")
+    print(f"simulated {int(np.where(pulls > 0, pulls, args.max_pulls).sum())} pulls, "
+          f"{int(days.sum())} user-days in {elapsed:.2f}s")
+    return 0
+
+
+def main(argv=None):
+    # 共通のオプション（サブコマンドの後ろに書く）
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--csv", default=CSV_PATH)
+    common.add_argument("--banners", default=BANNERS_PATH)
+    common.add_argument("--banner", help="banner id in banners.json (default: the plain catalog rates)")
+    common.add_argument("--seed", type=int)
+
+    parser = argparse.ArgumentParser(description="Check gacha rates and completion times by Monte Carlo simulation")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rates_cmd = sub.add_parser("rates", parents=[common], help="draw from the sampler and compare with the rate column")
+    rates_cmd.add_argument("--pulls", type=int, default=10_000_000)
+    audit_cmd = sub.add_parser("audit", parents=[common], help="compare logged draw events with the rate column")
+    audit_cmd.add_argument("events", nargs="+", help="events.jsonl (and rotated files)")
+    for cmd in (rates_cmd, audit_cmd):
+        cmd.add_argument("--top", type=int, default=10, help="cards to list by |z| (0: all)")
+        cmd.add_argument("--alpha", type=float, default=0.001, help="exit 1 if the chi-square p-value is below this")
+
+    complete_cmd = sub.add_parser("complete", parents=[common], help="simulate pulls and days until a set is complete")
+    complete_cmd.add_argument("--users", type=int, default=20000)
+    complete_cmd.add_argument("--chname", action="append", help="only cards of this character (repeatable)")
+    complete_cmd.add_argument("--rarity", action="append", help="only cards of this rarity (repeatable)")
+    complete_cmd.add_argument("--daily", type=int, help="daily points (default: the saved setting or 3)")
+    complete_cmd.add_argument("--interval", type=int, default=1, help="days between sessions")
+    complete_cmd.add_argument("--max-pulls", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    commands = {"rates": cmd_rates, "audit": cmd_audit, "complete": cmd_complete}
+    return commands[args.command](args, rng)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
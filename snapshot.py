@@ -0,0 +1,228 @@
+"""
+ガチャデータのバイナリスナップショット
+
+CSVを一度だけ解析して、数値列・抽選テーブル・文字列表をまとめたファイルにする。
+起動時は mmap で開くだけなので、エンコーディング判定やCSV解析が不要になり、
+同じマシンの複数プロセス・シャードで1つの読み取り専用のページを共有できる。
+
+    python snapshot.py build data/gacha_data.csv         # data/gacha_data.csv.snap を作成
+    python snapshot.py info data/gacha_data.csv.snap
+
+ファイル形式（リトルエンディアン、各セクションは8バイト境界に揃える）:
+    ヘッダー  HEADER
+    rate      f64[n]   排出率
+    prob      f64[n]   エイリアス法の確率テーブル
+    alias     u32[n]   エイリアス法の別名テーブル
+    no        u32[n]   カード番号（所持ビットの位置）
+    rarity    u8[n]    レア度コード（rarity_namesの添字）
+    strings   u32[n*4] no(文字列)・chname・title・url の文字列表の添字
+    rarity_names u32[r] レア度名の文字列表の添字
+    offsets   u32[m+1] 文字列表の各文字列の開始位置
+    blob      UTF-8の文字列表（重複は1つにまとめる）
+"""
+import os
+import sys
+import mmap
+import struct
+import logging
+import argparse
+import tempfile
+from types import MappingProxyType
+
+from sampler import AliasSampler
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"GACHASNP"
+FORMAT_VERSION = 2  # 2: 不正な行を除いた内容では作らない（それ以前のものは作り直す）
+# magic, 形式バージョン, カード数, 文字列数, レア度数, CSVのsha256, 元のエンコーディング
+HEADER = struct.Struct("<8sIIII32s16s")
+STRING_COLUMNS = ("no", "chname", "title", "url")
+SUFFIX = ".snap"
+
+
+def default_path(csv_path):
+    return csv_path + SUFFIX
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _layout(n, n_strings, n_rarities):
+    """各セクションの (開始位置, 型, 要素数)"""
+    sections = {}
+    offset = _align(HEADER.size)
+    for name, fmt, count in (
+        ("rate", "d", n),
+        ("prob", "d", n),
+        ("alias", "I", n),
+        ("no", "I", n),
+        ("rarity", "B", n),
+        ("strings", "I", n * len(STRING_COLUMNS)),
+        ("rarity_names", "I", n_rarities),
+        ("offsets", "I", n_strings + 1),
+    ):
+        sections[name] = (offset, fmt, count)
+        offset = _align(offset + struct.calcsize(fmt) * count)
+    sections["blob"] = (offset, "B", None)
+    return sections
+
+
+def build(catalog):
+    """Catalogからスナップショットのバイト列を作る"""
+    items = catalog.items
+    n = len(items)
+    interned = {}
+
+    def intern(text):
+        return interned.setdefault(text, len(interned))
+
+    rarity_names = sorted({item["rarity"] for item in items})
+    rarity_code = {name: i for i, name in enumerate(rarity_names)}
+    string_ids = [intern(item[col]) for item in items for col in STRING_COLUMNS]
+    rarity_ids = [intern(name) for name in rarity_names]
+
+    encoded = [text.encode('utf-8') for text in interned]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+
+    sampler = catalog.sampler
+    sections = _layout(n, len(encoded), len(rarity_names))
+    columns = {
+        "rate": [item["rate"] for item in items],
+        "prob": sampler.prob,
+        "alias": sampler.alias,
+        "no": [int(item["no"]) for item in items],
+        "rarity": [rarity_code[item["rarity"]] for item in items],
+        "strings": string_ids,
+        "rarity_names": rarity_ids,
+        "offsets": offsets,
+    }
+    blob_offset = sections["blob"][0]
+    out = bytearray(blob_offset + offsets[-1])
+    encoding = catalog.encoding.encode('ascii')[:16]
+    HEADER.pack_into(out, 0, MAGIC, FORMAT_VERSION, n, len(encoded), len(rarity_names),
+                     bytes.fromhex(catalog.digest), encoding)
+    for name, values in columns.items():
+        offset, fmt, count = sections[name]
+        struct.pack_into(f"<{count}{fmt}", out, offset, *values)
+    out[blob_offset:] = b"".join(encoded)
+    return bytes(out)
+
+
+def write(catalog, path):
+    """スナップショットを書き出す（一時ファイルに書いてから置き換える）"""
+    data = build(catalog)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".snap-", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return len(data)
+
+
+class Snapshot:
+    """mmapで開いたスナップショット（各列はmmap上のmemoryview）"""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, version, n, n_strings, n_rarities, digest, encoding = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path}: not a gacha snapshot (version {version})")
+        self.n = n
+        self.digest = digest.hex()
+        self.encoding = encoding.rstrip(b"\0").decode('ascii')
+        sections = _layout(n, n_strings, n_rarities)
+        self.columns = {}
+        for name, (offset, fmt, count) in sections.items():
+            if count is None:
+                self.columns[name] = view[offset:]
+            else:
+                self.columns[name] = view[offset:offset + struct.calcsize(fmt) * count].cast(fmt)
+
+    def string(self, index):
+        offsets = self.columns["offsets"]
+        return self.columns["blob"][offsets[index]:offsets[index + 1]].tobytes().decode('utf-8')
+
+    def sampler(self):
+        """保存済みのテーブルをそのまま使うAliasSampler（mmapを共有）"""
+        return AliasSampler.from_tables(self.columns["prob"], self.columns["alias"],
+                                        sum(self.columns["rate"]))
+
+    def items(self):
+        """Catalog.items と同じ形のdictのリスト（文字列は同じものを共有する）"""
+        strings = {}
+
+        def text(index):
+            if index not in strings:
+                strings[index] = sys.intern(self.string(index))
+            return strings[index]
+
+        width = len(STRING_COLUMNS)
+        ids = self.columns["strings"]
+        rarity_names = [text(i) for i in self.columns["rarity_names"]]
+        rate, rarity = self.columns["rate"], self.columns["rarity"]
+        items = []
+        for i in range(self.n):
+            no, chname, title, url = (text(ids[i * width + j]) for j in range(width))
+            items.append(MappingProxyType({
+                "no": no,
+                "url": url,
+                "chname": chname,
+                "rarity": rarity_names[rarity[i]],
+                "rate": rate[i],
+                "title": title,
+            }))
+        return items
+
+
+def open_snapshot(path, digest=None):
+    """スナップショットを開く。存在しない・壊れている・digestが違う場合はNone"""
+    try:
+        snap = Snapshot(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning(f"スナップショット {path} を読み込めません: {e}")
+        return None
+    if digest is not None and snap.digest != digest:
+        return None
+    return snap
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the gacha CSV into a binary snapshot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="compile a CSV file")
+    build_cmd.add_argument("csv")
+    build_cmd.add_argument("-o", "--output")
+    info_cmd = sub.add_parser("info", help="show a snapshot header")
+    info_cmd.add_argument("snapshot")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        from catalog import Catalog
+        catalog = Catalog.from_path(args.csv)
+        output = args.output or default_path(args.csv)
+        size = write(catalog, output)
+        print(f"{output}: {len(catalog)} items, {size} bytes, version={catalog.version}")
+    else:
+        snap = open_snapshot(args.snapshot)
+        if snap is None:
+            print(f"{args.snapshot}: cannot open")
+            return 1
+        print(f"{args.snapshot}: {snap.n} items, encoding={snap.encoding}, version={snap.digest[:12]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from catalog import parse_catalog, CatalogError, CatalogStore
+
+HEADER = "filename,url,chname,rarity,rate,No.,title\n"
+
+
+def csv_bytes(*nos):
+    return (HEADER + "".join(f"f.png,u,ch,N,0.5,{no},t\n" for no in nos)).encode('utf-8')
+
+
+def test_rejects_card_numbers_that_are_not_bit_positions():
+    for no in ("EX1", "007", "-1", "70000"):
+        with pytest.raises(CatalogError, match=no):
+            parse_catalog(csv_bytes("1", no), 'utf-8')
+    with pytest.raises(CatalogError):
+        parse_catalog(csv_bytes("1", "1"), 'utf-8')
+
+
+def test_skip_invalid_keeps_the_valid_rows():
+    items = parse_catalog(csv_bytes("1", "EX1", "2"), 'utf-8', skip_invalid=True)
+    assert [item["no"] for item in items] == ["1", "2"]
+
+
+def test_store_does_not_snapshot_a_catalog_with_skipped_rows(tmp_path):
+    path = tmp_path / "gacha.csv"
+    path.write_bytes(csv_bytes("1", "EX1", "2"))
+    store = CatalogStore(str(path))
+    assert len(store.load()) == 2
+    assert not (tmp_path / "gacha.csv.snap").exists()
+    # 次の起動でも検証される（不正な行はまた除かれ、ログに出る）
+    assert store.load().skipped == 1
+
+    path.write_bytes(csv_bytes("1", "2"))
+    assert len(store.load()) == 2
+    assert (tmp_path / "gacha.csv.snap").exists()
+
+
+def test_store_starts_without_a_catalog_until_the_file_is_fixed(tmp_path):
+    path = tmp_path / "gacha.csv"
+    store = CatalogStore(str(path), snapshot_path="")
+    assert store.load() is None
+
+    path.write_bytes(HEADER.encode('utf-8'))
+    assert store.load() is None
+    path.write_bytes(csv_bytes("1").replace(b",0.5,", b",0,"))
+    assert store.load() is None
+    assert store.current is None
+
+    path.write_bytes(csv_bytes("1", "2"))
+    assert asyncio.run(store.refresh())
+    assert len(store.current) == 2
@@ -0,0 +1,137 @@
+import random
+
+from points import PointLedger, GRANT_DAILY, GRANT_ADMIN
+
+CAP = 15
+
+
+class DirectSweep:
+    """以前の実装と同じく、全体付与のたびに全ユーザーの残高を書き換える基準実装"""
+    def __init__(self, initial_points=15, cap=CAP):
+        self.initial_points = initial_points
+        self.cap = cap
+        self.points = {}
+
+    def ensure(self, user_id):
+        self.points.setdefault(user_id, self.initial_points)
+
+    def grant_all(self, amount, kind):
+        for user_id, points in self.points.items():
+            if kind == GRANT_DAILY:
+                if points < self.cap:
+                    self.points[user_id] = min(self.cap, points + amount)
+            else:
+                self.points[user_id] = min(self.cap, points + amount)
+
+    def add(self, user_id, amount):
+        self.points[user_id] = min(self.cap, self.points[user_id] + amount)
+
+
+def assert_same(ledger, sweep):
+    assert {user_id: ledger.get(user_id) for user_id in sweep.points} == sweep.points
+
+
+def test_matches_direct_sweep():
+    rng = random.Random(0)
+    ledger, sweep = PointLedger(cap=CAP), DirectSweep()
+    users = list(range(30))
+    for _ in range(3000):
+        user_id = rng.choice(users)
+        op = rng.random()
+        if op < 0.3:
+            ledger.ensure(user_id)
+            sweep.ensure(user_id)
+        elif op < 0.4:
+            kind = rng.choice((GRANT_DAILY, GRANT_ADMIN))
+            amount = rng.randint(1, 5)
+            ledger.grant_all(amount, kind)
+            sweep.grant_all(amount, kind)
+        elif user_id in sweep.points:
+            if op < 0.8:
+                # ガチャ: 残高を読んでから消費する
+                cost = rng.choice((1, 10))
+                points = ledger.get(user_id)
+                assert points == sweep.points[user_id]
+                if points >= cost:
+                    ledger.set(user_id, points - cost)
+                    sweep.points[user_id] -= cost
+            else:
+                amount = rng.randint(1, 5)
+                ledger.add(user_id, amount)
+                sweep.add(user_id, amount)
+    assert_same(ledger, sweep)
+
+
+def test_daily_grant_skips_users_over_the_cap_but_admin_grant_clamps():
+    ledger, sweep = PointLedger(cap=CAP), DirectSweep()
+    for user_id, points in ((1, 20), (2, 14), (3, 0)):
+        ledger.ensure(user_id)
+        ledger.set(user_id, points)
+        sweep.points[user_id] = points
+
+    ledger.grant_all(3, GRANT_DAILY)
+    sweep.grant_all(3, GRANT_DAILY)
+    assert_same(ledger, sweep)
+    assert ledger.get(1) == 20 and ledger.get(2) == CAP and ledger.get(3) == 3
+
+    ledger.grant_all(3, GRANT_ADMIN)
+    sweep.grant_all(3, GRANT_ADMIN)
+    assert_same(ledger, sweep)
+    assert ledger.get(1) == CAP and ledger.get(3) == 6
+
+
+def test_settles_pending_grants_before_a_spend():
+    ledger = PointLedger(cap=CAP)
+    ledger.ensure(1)
+    ledger.set(1, 0)
+    ledger.grant_all(3, GRANT_DAILY)
+    ledger.grant_all(3, GRANT_DAILY)
+    ledger.set(1, ledger.get(1) - 1)
+    # 消費の時点までの付与は精算済みなので、二重に足されない
+    assert ledger.record(1) == (5, 2)
+    ledger.grant_all(3, GRANT_DAILY)
+    assert ledger.get(1) == 8
+
+
+def test_users_registered_after_a_grant_do_not_receive_it():
+    ledger = PointLedger(cap=CAP)
+    ledger.grant_all(5, GRANT_ADMIN)
+    ledger.ensure(1)
+    assert ledger.record(1) == (15, 1)
+    ledger.set(1, 0)
+    assert ledger.get(1) == 0
+
+
+def test_store_from_a_later_epoch_is_not_granted_again():
+    ledger = PointLedger(cap=CAP)
+    ledger.ensure(1)
+    ledger.grant_all(3, GRANT_ADMIN)
+    # 別プロセスがこのプロセスの知らない付与2件まで精算した残高
+    ledger.store(1, 7, 3)
+    assert ledger.get(1) == 7
+    ledger.extend_grants([(GRANT_DAILY, 3), (GRANT_DAILY, 3)])
+    assert ledger.get(1) == 7
+    ledger.grant_all(3, GRANT_DAILY)
+    assert ledger.get(1) == 10
+
+    # 古いepochの残高なら、その後の付与だけを精算する
+    ledger.store(2, 1, 2)
+    assert ledger.get(2) == 7
+
+
+def test_load_after_restart():
+    ledger = PointLedger(cap=CAP)
+    for user_id in range(3):
+        ledger.ensure(user_id)
+        ledger.set(user_id, user_id)
+    ledger.grant_all(2, GRANT_DAILY)
+    ledger.get(0)  # user 0 だけ精算済み
+    balances = {user_id: ledger.record(user_id) for user_id in range(3)}
+    assert balances[0] == (2, 1) and balances[1] == (1, 0)
+
+    restarted = PointLedger(cap=CAP)
+    restarted.load(balances, list(ledger.grants))
+    assert [restarted.get(user_id) for user_id in range(3)] == [2, 3, 4]
+    restarted.grant_all(CAP, GRANT_ADMIN)
+    assert [restarted.get(user_id) for user_id in range(3)] == [CAP] * 3
+    assert restarted.epoch == 2
@@ -0,0 +1,60 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from sampler import AliasSampler
+
+WEIGHTS = [5.0, 0.0, 1.0, 3.0, 0.5, 0.5]
+DRAWS = 200000
+
+
+def expected():
+    total = sum(WEIGHTS)
+    return [w / total for w in WEIGHTS]
+
+
+def assert_frequencies(indices):
+    counts = Counter(indices)
+    assert set(counts) <= set(range(len(WEIGHTS)))
+    assert counts[1] == 0  # 重み0のカードは出ない
+    for i, p in enumerate(expected()):
+        assert counts[i] / len(indices) == pytest.approx(p, abs=0.005)
+
+
+def test_draw_matches_weights():
+    sampler = AliasSampler(WEIGHTS, rng=random.Random(1))
+    assert_frequencies([sampler.draw() for _ in range(DRAWS)])
+
+
+def test_draw_many_and_draw_array_match_weights():
+    sampler = AliasSampler(WEIGHTS).seed(2)
+    many = sampler.draw_many(DRAWS)
+    assert all(isinstance(i, int) for i in many[:100])
+    assert_frequencies(many)
+
+    array = sampler.draw_array(DRAWS, np.random.default_rng(3))
+    assert array.dtype == np.intp
+    assert array.min() >= 0 and array.max() < len(WEIGHTS)
+    assert_frequencies(array.tolist())
+
+
+def test_seed_reproduces_the_draws():
+    a = AliasSampler(WEIGHTS).seed(4)
+    b = AliasSampler(WEIGHTS).seed(4)
+    assert [a.draw() for _ in range(100)] == [b.draw() for _ in range(100)]
+    assert a.draw_many(100) == b.draw_many(100)
+
+
+def test_from_tables_draws_the_same_as_the_original():
+    sampler = AliasSampler(WEIGHTS).seed(5)
+    copy = AliasSampler.from_tables(list(sampler.prob), list(sampler.alias), sampler.total).seed(5)
+    assert sampler.draw_many(1000) == copy.draw_many(1000)
+
+
+def test_rejects_empty_or_zero_weights():
+    with pytest.raises(ValueError):
+        AliasSampler([])
+    with pytest.raises(ValueError):
+        AliasSampler([0.0, 0.0])
@@ -0,0 +1,139 @@
+import sqlite3
+import asyncio
+
+import pytest
+
+import db
+import writebehind
+from writebehind import WriteBehindQueue
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    db.close()
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "db.sqlite"))
+    db.init_db()
+    yield tmp_path
+    db.close()
+
+
+def points_of(user_id):
+    row = db.get_connection().execute("SELECT points FROM user_points WHERE user_id=?", (user_id,)).fetchone()
+    return row[0] if row else None
+
+
+def test_replays_journal_after_crash(fresh_db):
+    journal = str(fresh_db / "journal")
+
+    async def crash():
+        queue = WriteBehindQueue(journal, durability="journal")
+        await db.run(queue.recover)
+        fut = queue.submit("set_points", 1, 7, 0)
+        # ジャーナルに書いた(ackした)ところでDBへの適用前に落ちたことにする
+        await queue._write_batch_journal(list(queue._pending))
+        assert fut.done()
+
+    asyncio.run(crash())
+    assert points_of(1) is None
+
+    queue = WriteBehindQueue(journal, durability="journal")
+    queue.recover()
+    assert points_of(1) == 7
+    assert int(db.get_setting(queue.seq_key)) == 1
+
+
+def test_bad_op_does_not_lose_acknowledged_writes(fresh_db):
+    journal = str(fresh_db / "journal")
+
+    async def run():
+        queue = WriteBehindQueue(journal, durability="journal")
+        await db.run(queue.recover)
+        good = queue.submit("set_points", 1, 9, 0)
+        bad = queue.submit("set_points", 2)  # 引数が足りない
+        assert await queue.flush()
+        await good
+        await bad  # ジャーナルに書いた時点でack済み
+        assert queue.stats.dropped == 1
+        await queue.close()
+
+    asyncio.run(run())
+    assert points_of(1) == 9
+    assert int(db.get_setting("journal_seq")) == 1
+
+
+def test_bad_op_fails_its_future_with_commit_durability(fresh_db):
+    async def run():
+        queue = WriteBehindQueue(str(fresh_db / "journal"), durability="commit")
+        await db.run(queue.recover)
+        good = queue.submit("set_points", 1, 9, 0)
+        bad = queue.submit("set_points", 2)
+        assert await queue.flush()
+        await good
+        with pytest.raises(TypeError):
+            await bad
+        await queue.close()
+
+    asyncio.run(run())
+    assert points_of(1) == 9
+
+
+def test_transient_error_keeps_batch_and_journal(fresh_db, monkeypatch):
+    journal = str(fresh_db / "journal")
+    apply_batch = db.apply_batch
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def flaky(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return apply_batch(*args, **kwargs)
+
+    async def run():
+        queue = WriteBehindQueue(journal, durability="journal")
+        await db.run(queue.recover)
+        monkeypatch.setattr(db, "apply_batch", flaky)
+        fut = queue.submit("set_points", 1, 5, 0)
+        assert not await queue.flush()
+        assert fut.done()  # ジャーナルに書いた時点でack済み
+        assert len(queue._pending) == 1
+        assert db.get_setting(queue.seq_key) is None
+        with open(journal, encoding='utf-8') as f:
+            assert len(f.readlines()) == 1
+        assert await queue.flush()
+        with open(journal, encoding='utf-8') as f:
+            assert f.read() == ""
+        await queue.close()
+
+    asyncio.run(run())
+    assert points_of(1) == 5
+    assert int(db.get_setting("journal_seq")) == 1
+
+
+def test_retry_does_not_duplicate_journal_lines(fresh_db, monkeypatch):
+    journal = str(fresh_db / "journal")
+    monkeypatch.setattr(writebehind, "RETRY_DELAY", 0)
+    monkeypatch.setattr(db, "apply_batch", lambda *args, **kwargs: (_ for _ in ()).throw(
+        sqlite3.OperationalError("database is locked")))
+
+    async def run():
+        queue = WriteBehindQueue(journal, durability="journal")
+        await db.run(queue.recover)
+        queue.submit("set_points", 1, 5, 0)
+        assert not await queue.flush()
+        queue.submit("set_points", 2, 6, 0)
+        assert not await queue.flush()
+        with open(journal, encoding='utf-8') as f:
+            assert [line.split(",")[0] for line in f] == ["[1", "[2"]
+        queue._close_journal()
+
+    asyncio.run(run())
+
+
+def test_replay_skips_bad_ops(fresh_db):
+    journal = fresh_db / "journal"
+    journal.write_text('[1, "set_points", [2]]\n[2, "set_points", [1, 4, 0]]\n[3, "set_po', encoding='utf-8')
+    queue = WriteBehindQueue(str(journal), durability="journal")
+    queue.recover()
+    queue._close_journal()
+    assert points_of(1) == 4
+    assert int(db.get_setting(queue.seq_key)) == 2
+    assert journal.read_text() == ""
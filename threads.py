@@ -0,0 +1,61 @@
+class ThreadRegistry:
+    """
+    ユーザー専用ガチャスレッドの対応表（サーバー・ユーザー ↔ スレッド）
+    どちら向きの検索もdict1回で済む。内容はDBの gacha_threads に保存し、起動時に読み込む。
+    """
+    def __init__(self):
+        self._by_user = {}    # (guild_id, user_id) -> thread_id
+        self._by_thread = {}  # thread_id -> (guild_id, user_id)
+        self.archived = set() # アーカイブ済みのthread_id
+
+    def load(self, rows):
+        """rows: [(thread_id, guild_id, user_id, archived), ...]"""
+        self._by_user.clear()
+        self._by_thread.clear()
+        self.archived.clear()
+        for thread_id, guild_id, user_id, archived in rows:
+            self.register(guild_id, user_id, thread_id)
+            if archived:
+                self.archived.add(thread_id)
+
+    def __contains__(self, thread_id):
+        return thread_id in self._by_thread
+
+    def __len__(self):
+        return len(self._by_thread)
+
+    def get(self, guild_id, user_id):
+        """ユーザーのスレッドID（なければNone）"""
+        return self._by_user.get((guild_id, user_id))
+
+    def owner(self, thread_id):
+        """スレッドの持ち主のユーザーID（登録されていなければNone）"""
+        entry = self._by_thread.get(thread_id)
+        return entry[1] if entry else None
+
+    def register(self, guild_id, user_id, thread_id):
+        """登録する。同じユーザーの古いスレッドがあれば置き換えてそのIDを返す"""
+        old = self._by_user.get((guild_id, user_id))
+        if old is not None and old != thread_id:
+            self._by_thread.pop(old, None)
+            self.archived.discard(old)
+        self._by_user[(guild_id, user_id)] = thread_id
+        self._by_thread[thread_id] = (guild_id, user_id)
+        return old if old != thread_id else None
+
+    def unregister(self, thread_id):
+        """スレッドの登録を消す。消した場合は (guild_id, user_id) を返す"""
+        entry = self._by_thread.pop(thread_id, None)
+        if entry is not None:
+            self._by_user.pop(entry, None)
+            self.archived.discard(thread_id)
+        return entry
+
+    def set_archived(self, thread_id, archived):
+        if thread_id not in self._by_thread:
+            return False
+        if archived:
+            self.archived.add(thread_id)
+        else:
+            self.archived.discard(thread_id)
+        return True
@@ -0,0 +1,124 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from ownership import CardSet
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOCK_STRIPES = 256  # ロックの本数（ユーザーIDのハッシュで振り分け）
+
+
+class LockStats:
+    """ロック待ち時間の集計"""
+    def __init__(self):
+        self.acquires = 0
+        self.contended = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait):
+        self.acquires += 1
+        if wait > 0.0005:
+            self.contended += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def as_dict(self):
+        return {
+            "acquires": self.acquires,
+            "contended": self.contended,
+            "avg_wait_ms": self.total_wait * 1000 / self.acquires if self.acquires else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+class StripedLock:
+    """
+    キーごとの非同期ロック（固定本数のロックをキーのハッシュで共有する）
+    同じユーザーの処理は直列に、別ユーザーの処理はほぼ並列に実行される。
+    """
+    def __init__(self, stripes=LOCK_STRIPES):
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self.stats = LockStats()
+
+    @asynccontextmanager
+    async def hold(self, key):
+        lock = self._locks[hash(key) % len(self._locks)]
+        started = time.perf_counter()
+        async with lock:
+            self.stats.record(time.perf_counter() - started)
+            yield
+
+
+class PullResult:
+    def __init__(self, remaining_points, results):
+        self.remaining_points = remaining_points
+        self.results = results  # [(item, is_new), ...]
+
+
+class PullEngine:
+    """
+    ガチャ1回分（ポイント消費・抽選・カード付与・保存）をユーザー単位で不可分に実行する
+    連打されても同じポイントを二重に使うことはない。
+    """
+    def __init__(self, bot, stripes=LOCK_STRIPES):
+        self.bot = bot
+        self.locks = StripedLock(stripes)
+
+    async def pull(self, user_id, count, catalog):
+        """catalog（CatalogかBanner）からcount回引く。ポイント不足ならNoneを返す"""
+        if getattr(self.bot, "shared_state", False):
+            return await self._pull_shared(user_id, count, catalog)
+        async with self.locks.hold(user_id):
+            self.bot.ensure_user_points(user_id)
+            points = self.bot.points.get(user_id)
+            if points < count:
+                return None
+            items = [catalog.draw()] if count == 1 else catalog.draw_many(count)
+
+            remaining_points = points - count
+            self.bot.points.set(user_id, remaining_points)
+            cards = self.bot.user_cards.setdefault(user_id, CardSet())
+            results = [(item, cards.add(item["no"])) for item in items]
+            for item in items:
+                metrics.DRAWS.inc(item["rarity"])
+            self.bot.progress.add_cards(user_id, [item["no"] for item, is_new in results if is_new])
+
+            # 書き込みはキューに入れるだけ（同じユーザーの変更は投入順に書かれる）
+            acks = [self.bot.save_points(user_id)]
+            if any(is_new for _, is_new in results):
+                acks.append(self.bot.writer.submit("set_collection", user_id, cards.to_hex()))
+        # ackはロックを離してから待つ（同じロックを共有する別ユーザーを待たせない）
+        try:
+            await asyncio.gather(*acks)
+        except Exception:
+            # メモリ上はすでに反映済みなので、結果は返す（書き込みの失敗は書き込みキュー側で記録済み）
+            logger.exception(f"ガチャ結果の書き込みに失敗しました: user_id={user_id}")
+        return PullResult(remaining_points, results)
+
+    async def _pull_shared(self, user_id, count, catalog):
+        """
+        複数プロセスでDBを共有する場合: ポイントの確認・消費とカード追加を
+        DBの1トランザクション(BEGIN IMMEDIATE)で行い、結果でメモリ上のキャッシュを更新する
+        """
+        async with self.locks.hold(user_id):
+            items = [catalog.draw()] if count == 1 else catalog.draw_many(count)
+            ok, remaining_points, epoch, before = await db.run(
+                db.pull, user_id, count, [item["no"] for item in items],
+                self.bot.points.initial_points, self.bot.points.cap)
+            self.bot.points.store(user_id, remaining_points, epoch)
+            if not ok:
+                self.bot.user_cards[user_id] = before
+                self.bot.progress.set_user(user_id, before)
+                return None
+            cards = CardSet(before.bits)
+            results = [(item, cards.add(item["no"])) for item in items]
+            self.bot.user_cards[user_id] = cards
+            self.bot.progress.set_user(user_id, cards)
+            for item in items:
+                metrics.DRAWS.inc(item["rarity"])
+        return PullResult(remaining_points, results)
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# まとめ書きの間隔(ミリ秒)と1回の最大件数
+FLUSH_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "5"))
+BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "256"))
+# 書き込み完了(ack)とみなすタイミング
+#   none    : キューに入れた時点（クラッシュ時は未書き込み分を失う）
+#   journal : ジャーナルファイルに書き込んだ時点（プロセスが落ちても失わない）
+#   fsync   : ジャーナルをfsyncした時点（OSが落ちても失わない）
+#   commit  : DBにcommitした時点
+DURABILITY = os.getenv("WRITE_BEHIND_DURABILITY", "journal")
+DURABILITY_LEVELS = ("none", "journal", "fsync", "commit")
+JOURNAL_PATH = os.getenv("WRITE_BEHIND_JOURNAL", db.DB_PATH + ".journal")
+# DBがロック中などで書き込めなかった時に再試行するまでの待ち時間(秒)
+RETRY_DELAY = float(os.getenv("WRITE_BEHIND_RETRY_DELAY", "0.5"))
+
+
+def is_transient(error):
+    """再試行すれば通る可能性のあるエラーか（他プロセスがDBをロック中など）"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+class WriteStats:
+    """フラッシュの回数・件数・所要時間の集計"""
+    def __init__(self):
+        self.flushes = 0
+        self.ops = 0
+        self.errors = 0
+        self.retries = 0
+        self.dropped = 0
+        self.max_batch = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+    def record(self, batch_size, latency):
+        self.flushes += 1
+        self.ops += batch_size
+        self.max_batch = max(self.max_batch, batch_size)
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_latency = latency
+
+    def as_dict(self):
+        return {
+            "flushes": self.flushes,
+            "ops": self.ops,
+            "errors": self.errors,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "avg_batch": self.ops / self.flushes if self.flushes else 0.0,
+            "max_batch": self.max_batch,
+            "avg_latency_ms": self.total_latency * 1000 / self.flushes if self.flushes else 0.0,
+            "max_latency_ms": self.max_latency * 1000,
+            "last_latency_ms": self.last_latency * 1000,
+        }
+
+
+def _retrieve(fut):
+    # 待たれないFutureの例外で警告が出ないようにする（エラーはフラッシュ側でログ済み）
+    if not fut.cancelled():
+        fut.exception()
+
+
+class WriteBehindQueue:
+    """
+    ポイント・カードの変更をためておき、一定間隔または一定件数ごとに
+    1トランザクションでまとめてDBへ書き込む（グループコミット）。
+    ack前の変更は追記専用のジャーナルに残すので、クラッシュしても起動時に再適用される。
+    DBに書き込めなかったバッチはキューの先頭に戻して再試行し、コミットするまで
+    通し番号を進めずジャーナルも消さない。
+    """
+    def __init__(self, journal_path=None, interval_ms=FLUSH_INTERVAL_MS,
+                 batch_size=BATCH_SIZE, durability=DURABILITY, name=""):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"unknown durability level: {durability}")
+        # 複数プロセスで同じDBを使う時は、プロセス(name)ごとにジャーナルと通し番号を分ける
+        self.name = name
+        self.journal_path = journal_path or (f"{JOURNAL_PATH}.{name}" if name else JOURNAL_PATH)
+        self.seq_key = f"journal_seq.{name}" if name else "journal_seq"
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+        self.durability = durability
+        self.stats = WriteStats()
+        self._pending = []  # [(seq, op, args, future)]
+        self._seq = 0
+        self._journaled = 0  # ジャーナルに書き込み済みの最大の通し番号
+        self._journal = None
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+
+    # --- 以下の同期メソッドはDB用スレッドで実行する ---
+
+    def recover(self):
+        """起動時: ジャーナルに残っている未コミットの変更をDBへ再適用する"""
+        last = int(db.get_setting(self.seq_key, 0))
+        ops = []
+        max_seq = last
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        seq, op, args = json.loads(line)
+                    except ValueError:
+                        # 書き込み途中で落ちた最終行
+                        logger.warning("ジャーナルの壊れた行を無視しました")
+                        continue
+                    if seq > last:
+                        ops.append((op, args))
+                    max_seq = max(max_seq, seq)
+        if ops:
+            try:
+                db.apply_batch(ops, max_seq, self.seq_key)
+            except Exception as e:
+                if is_transient(e):
+                    raise
+                # 不正な変更が混ざっていても、それ以外は失わないよう1件ずつ適用する
+                for op, args in ops:
+                    try:
+                        db.apply_batch([(op, args)])
+                    except Exception as e:
+                        if is_transient(e):
+                            raise
+                        logger.error(f"ジャーナルの適用できない変更を破棄しました: op={op} args={args}: {e!r}")
+                db.set_setting(self.seq_key, max_seq)
+            logger.info(f"Replayed {len(ops)} journaled write(s)")
+        self._seq = max_seq
+        self._journaled = max_seq
+        self._journal = open(self.journal_path, 'ab')
+        self._journal.truncate(0)
+
+    def _write_journal(self, lines, fsync):
+        self._journal.write(b"".join(lines))
+        self._journal.flush()
+        if fsync:
+            os.fsync(self._journal.fileno())
+
+    def _truncate_journal(self):
+        self._journal.truncate(0)
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    # --- イベントループ側 ---
+
+    def submit(self, op, *args):
+        """変更を1件キューに入れ、durabilityに応じてackされるFutureを返す"""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        fut.add_done_callback(_retrieve)
+        self._seq += 1
+        self._pending.append((self._seq, op, list(args), fut))
+        if self.durability == "none":
+            fut.set_result(None)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return fut
+
+    async def _write_batch_journal(self, batch):
+        # 再試行のバッチはジャーナルに書き込み済みなので、まだの分だけ書く
+        entries = [entry for entry in batch if entry[0] > self._journaled]
+        if not entries:
+            return
+        lines = [json.dumps([seq, op, args], ensure_ascii=False).encode('utf-8') + b"\n"
+                 for seq, op, args, _ in entries]
+        await db.run(self._write_journal, lines, self.durability == "fsync")
+        self._journaled = entries[-1][0]
+        if self.durability in ("journal", "fsync"):
+            for _, _, _, fut in entries:
+                if not fut.done():
+                    fut.set_result(None)
+
+    async def _apply_each(self, batch):
+        """1件ずつ適用して、適用できない変更だけを除く。一時的なエラーで残った分を返す"""
+        for i, (seq, op, args, fut) in enumerate(batch):
+            try:
+                await db.run(db.apply_batch, [(op, args)], seq, self.seq_key)
+            except Exception as e:
+                if is_transient(e):
+                    return batch[i:]
+                # 引数の誤りなどは何度やり直しても失敗するので捨てる
+                self.stats.dropped += 1
+                logger.error(f"適用できない変更を破棄しました: seq={seq} op={op} args={args}: {e!r}")
+                if not fut.done():
+                    fut.set_exception(e)
+                continue
+            if not fut.done():
+                fut.set_result(None)
+        return []
+
+    async def _flush_batch(self, batch):
+        """バッチを書き込む。コミットできなかった分（再試行する分）を返す"""
+        started = time.perf_counter()
+        try:
+            if self.durability != "none":
+                await self._write_batch_journal(batch)
+            await db.run(db.apply_batch, [(op, args) for _, op, args, _ in batch], batch[-1][0], self.seq_key)
+        except Exception as e:
+            self.stats.errors += 1
+            if is_transient(e) or isinstance(e, OSError):
+                logger.warning(f"書き込みキューのフラッシュに失敗しました。再試行します: {e!r}")
+                return batch
+            logger.exception("書き込みキューのフラッシュに失敗しました。1件ずつ適用し直します:")
+            rest = await self._apply_each(batch)
+            if rest:
+                return rest
+        else:
+            for _, _, _, fut in batch:
+                if not fut.done():
+                    fut.set_result(None)
+        self.stats.record(len(batch), time.perf_counter() - started)
+        return []
+
+    async def flush(self):
+        """たまっている変更をすべて書き込む。書き込めない分が残ったらFalse"""
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            rest = await self._flush_batch(batch)
+            if rest:
+                # 順番を保つため先頭に戻す（通し番号はコミットした分までしか進んでいない）
+                self._pending[:0] = rest
+                self.stats.retries += 1
+                return False
+        if self.durability != "none" and self._journal is not None:
+            # ジャーナルの内容はすべてコミット済み
+            try:
+                await db.run(self._truncate_journal)
+            except OSError:
+                logger.exception("ジャーナルを空にできませんでした:")
+        return True
+
+    async def _run(self):
+        while not self._stopping:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            if len(self._pending) < self.batch_size:
+                # 少し待って後続の変更とまとめる
+                await asyncio.sleep(self.interval)
+            if not await self.flush():
+                await asyncio.sleep(RETRY_DELAY)
+                self._wakeup.set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            if self._pending:
+                self._wakeup.set()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            # フラッシュの途中で止めるとバッチを失うので、区切りまで待つ
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if not await self.flush():
+            error = RuntimeError("write-behind queue closed with unwritten changes")
+            logger.error(f"{len(self._pending)}件の変更を書き込めませんでした（ジャーナルの分は次回起動時に再適用します）")
+            for _, _, _, fut in self._pending:
+                if not fut.done():
+                    fut.set_exception(error)
+        await db.run(self._close_journal)